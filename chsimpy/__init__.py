@@ -1,12 +1,39 @@
-from .cli_parser import CLIParser
-from .plotview import PlotView
-from .solver import Solver
-from .simulator import Simulator
-from .parameters import Parameters
-from .solution import Solution
-from .timedata import TimeData
+import importlib
 
 from .version import __version__
 
 
+# public classes by module, imported on first access (PEP 562), so heavy dependencies
+# (e.g. matplotlib of PlotView) are only loaded on the code paths which need them
+_exports = {
+    'CLIParser': 'cli_parser',
+    'PlotView': 'plotview',
+    'Solver': 'solver',
+    'Simulator': 'simulator',
+    'Parameters': 'parameters',
+    'Solution': 'solution',
+    'TimeData': 'timedata',
+}
+
 __all__ = ['CLIParser', 'PlotView', 'Solver', 'Simulator', 'Parameters', 'Solution', 'TimeData']
+
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(f".{_exports[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    if not name.startswith('_'):
+        # submodules, e.g. chsimpy.utils after a bare import chsimpy
+        try:
+            return importlib.import_module(f".{name}", __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":
+                raise
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    import pkgutil
+    submodules = {module.name for module in pkgutil.iter_modules(__path__) if not module.name.startswith('_')}
+    return sorted(set(globals()) | set(_exports) | submodules)
@@ -0,0 +1,113 @@
+"""
+Checkpoints of running simulations: atomically written .npz files to resume a run bit-for-bit
+
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from .version import __version__
+
+
+# increase if the layout of checkpoint files changes
+FORMAT_VERSION = 1
+
+# parameters which a resumed run takes from its own command line instead of the checkpoint
+RUN_CONTROL = ('ntmax', 'time_max', 'wall_max', 'file_id', 'no_gui', 'png', 'png_renderer', 'png_anim',
+               'png_anim_processes', 'yaml', 'export_csv', 'export_format', 'compress_csv', 'compress_codec',
+               'export_workers', 'update_every', 'no_diagrams', 'async_view', 'fft_workers', 'blas_threads',
+               'checkpoint_every', 'checkpoint_minutes', 'resume', 'spill_timedata')
+
+
+class Checkpointer:
+    def __init__(self, fname, every=None, minutes=None):
+        """Writes checkpoints of a solver to fname every n computed steps and/or every m wall-clock minutes"""
+        self.fname = fname
+        self.every = every
+        self.minutes = minutes
+        self._last = time.monotonic()
+
+    def due(self, computed_steps):
+        if self.every is not None and computed_steps % self.every == 0:
+            return True
+        return self.minutes is not None and time.monotonic() - self._last >= self.minutes * 60
+
+    def write(self, solver):
+        save(solver, self.fname)
+        self._last = time.monotonic()
+
+
+def save(solver, fname):
+    """Writes the state of the solver (see Solver.state()) and its parameters to fname
+
+    The file is written to a temporary file first and renamed, so fname is always a complete checkpoint.
+    """
+    arrays = {}
+    meta = {'format': FORMAT_VERSION,
+            'version': __version__,
+            'parameters': {k: v for k, v in vars(solver.params).items() if not callable(v)},
+            'A0': solver.solution.A0,
+            'A1': solver.solution.A1}
+    _flatten(solver.state(), '', arrays, meta)
+    arrays['meta'] = np.array(json.dumps(meta, default=lambda v: v.item()))
+    directory = os.path.dirname(os.path.abspath(fname))
+    fd, tmpname = tempfile.mkstemp(suffix='.npz.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmpname, fname)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+
+def load(fname, params=None):
+    """Returns the solver state of checkpoint fname (see Solver.restore())
+
+    The parameters of the checkpointed run are written to params, except RUN_CONTROL parameters
+    like ntmax or file_id. A0 and A1 are fixed to the values of the checkpointed run.
+    """
+    with np.load(fname) as f:
+        meta = json.loads(str(f['meta']))
+        if meta.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Checkpoint '{fname}' has format {meta.get('format')}, expected {FORMAT_VERSION}")
+        state = {}
+        for key in f.files:
+            if key != 'meta':
+                _set(state, key, f[key])
+    for key, value in meta.items():
+        if key not in ('format', 'version', 'parameters', 'A0', 'A1'):
+            _set(state, key, value)
+    if params is not None:
+        for key, value in meta['parameters'].items():
+            if key not in RUN_CONTROL and key != 'version':
+                setattr(params, key, value)
+        A0, A1 = meta['A0'], meta['A1']
+        if params.func_A0(params.temp) != A0:
+            params.func_A0 = lambda T: A0
+        if params.func_A1(params.temp) != A1:
+            params.func_A1 = lambda T: A1
+    return state
+
+
+def _flatten(state, prefix, arrays, meta):
+    """Splits nested dict state into arrays and JSON scalars with keys 'a.b'"""
+    for key, value in state.items():
+        name = prefix + key
+        if isinstance(value, dict) and key != 'rand_state':
+            _flatten(value, name + '.', arrays, meta)
+        elif isinstance(value, np.ndarray):
+            arrays[name] = value
+        else:
+            meta[name] = value
+
+
+def _set(state, name, value):
+    *parents, key = name.split('.')
+    for parent in parents:
+        state = state.setdefault(parent, {})
+    state[key] = value
@@ -1,7 +1,10 @@
 # https://docs.python.org/3/library/argparse.html
 import argparse
+import os
 
 from . import parameters
+from . import utils
+from .timedata import TimeData
 
 
 class CLIParser:
@@ -32,12 +35,29 @@ class CLIParser:
         group.add_argument('-t', '--time-max',
                            type=float,
                            help='Maximal time in minutes to simulate (ignores ntmax)')
+        group.add_argument('--wall-max',
+                           type=float,
+                           help='Maximal wall-clock minutes of a run (stops with reason "wall-limit")')
         group.add_argument('-z', '--full-sim',
                            action='store_true',
                            help='Do not stop simulation early when energy falls')
         group.add_argument('-a', '--adaptive-time',
                            action='store_true',
-                           help='Use adaptive-time stepping (approximation, experimental)')
+                           help='Use error-controlled adaptive time stepping (step doubling, PI controller, '
+                                'rejects steps above --adaptive-tol or increasing the energy)')
+        group.add_argument('--adaptive-tol',
+                           type=float,
+                           default=1e-4,
+                           help='Tolerated local error (RMS of U) per step of the adaptive time stepping')
+        group.add_argument('--dt-max',
+                           type=float,
+                           default=2e-6,
+                           help='Maximal time delta of the adaptive time stepping (larger values lose accuracy of t0)')
+        group.add_argument('--dt-ladder',
+                           type=int,
+                           default=4,
+                           help='Rounds adaptive time deltas to dt-max * 2^(-j/n) for n steps per octave '
+                                '(reuses cached coefficients, 0 = no rounding)')
         group.add_argument('--cinit',
                            type=float,
                            default=0.875,
@@ -62,7 +82,7 @@ class CLIParser:
         group.add_argument('--dt',
                            type=float,
                            default=3e-8,
-                           help='Time delta of simulation')
+                           help='Time delta of simulation (<=1e-6, stabilized integrators <=2e-6)')
         group.add_argument('-g', '--generator',
                            choices=['uniform', 'simplex', 'sobol', 'lcg'],
                            default='uniform',
@@ -73,14 +93,69 @@ class CLIParser:
                            help='Start seed for random number generators')
         group.add_argument('-j', '--jitter',
                            type=float,
-                           help='Adds noise based on -g in every step by provided factor [0, 0.1) (much slower)')
+                           help='Adds noise based on -g in every step by provided factor [0, 0.1) (produced ahead in a background thread)')
+
+        group.add_argument('--fft-backend',
+                           choices=['scipy', 'fftpack', 'pyfftw'],
+                           default='scipy',
+                           help='Backend of the discrete cosine transforms (pyfftw must be installed)')
+        group.add_argument('--fft-workers',
+                           default=1,
+                           type=int,
+                           help='Number of threads per discrete cosine transform (-1 = all cores)')
+        group.add_argument('--blas-threads',
+                           default=1,
+                           type=int,
+                           help='Number of threads of BLAS libraries (-1 = no limit)')
+        group.add_argument('--precision',
+                           choices=['float64', 'float32'],
+                           default='float64',
+                           help='Floating-point precision of the simulation fields (energies are summed in float64)')
+        group.add_argument('--diag-every',
+                           default=1,
+                           type=int,
+                           help='Compute metrics (E, E2, ...) only every n steps (energy stop check uses these steps)')
+        group.add_argument('--metrics',
+                           default='all',
+                           help='Metrics to compute, e.g. ...="E2,SA" (E2 is always computed until energy falls) '
+                                '[E, E2, SA, Ra, L2, PS]')
+        group.add_argument('--spectral-energy',
+                           action='store_true',
+                           help='Compute E2 from the DCT coefficients (Laplacian of the solver, no gradient pass) '
+                                'instead of finite-difference gradients')
+        group.add_argument('--integrator',
+                           choices=['semi-implicit', 'stabilized', 'bdf2', 'etdrk2'],
+                           default='semi-implicit',
+                           help='Time integrator of the DCT coefficients (stabilized schemes allow --dt up to 2e-6, '
+                                'bdf2 and etdrk2 keep t0 within 10%%)')
+        group.add_argument('--stabilization',
+                           type=float,
+                           help='Stabilization S of stabilized integrators (default: max(-G\'\')/2 in miscibility gap)')
+        group.add_argument('--warm-start',
+                           choices=[1, 2, 4],
+                           default=1,
+                           type=int,
+                           help='Runs the early phase on a N/n grid and upsamples the field spectrally to N (1 = off)')
+        group.add_argument('--warm-time',
+                           type=float,
+                           help='Physical time [s] of the coarse phase of --warm-start (default: energy criterion)')
+        group.add_argument('--warm-energy',
+                           default=2.0,
+                           type=float,
+                           help='--warm-start switches to N when E2 rose to this factor times its minimum (>1)')
 
         group = parser.add_argument_group('Input')
         group.add_argument('-p',
                            '--parameter-file',
                            help='Input yaml file with parameter values (overwrites CLI parameters)')
         group.add_argument('--Uinit-file',
-                           help='Initial U matrix file (csv or numpy bz2 format).')
+                           help='Initial U matrix file (csv, csv.bz2, npz or npy format, npy is memory-mapped).')
+        group.add_argument('--resume',
+                           help='Continues the run of a checkpoint file bit-for-bit (simulation parameters are '
+                                'taken from the checkpoint, e.g. use --ntmax/--time-max of the whole run)')
+        group.add_argument('--Uinit-cache',
+                           help='Directory caching generated initial U matrices (by generator, seed, N, cinit) '
+                                'as memory-mapped .npy files')
 
         group = parser.add_argument_group('Output')
         group.add_argument('-f', '--file-id',
@@ -94,20 +169,52 @@ class CLIParser:
         group.add_argument('--png',
                            action='store_true',
                            help='Export solution plot to PNG image file (see --file-id).')
+        group.add_argument('--png-renderer',
+                           default='auto',
+                           choices=['auto', 'matplotlib', 'lut'],
+                           help='Renderer of --png: matplotlib figure or lookup table colouring of the map of U only '
+                                '(auto = lut if --no-gui and --no-diagrams)')
         group.add_argument('--png-anim',
                            action='store_true',
                            help='Export live plotting to series of PNGs (--update-every required) (see --file-id).')
+        group.add_argument('--png-anim-processes',
+                           default=-1,
+                           type=int,
+                           help='Number of processes rendering the PNGs of --png-anim after the run (-1 = auto)')
         group.add_argument('--yaml',
                            action='store_true',
                            help='Export parameters to yaml file (see --file-id).')
         group.add_argument('--export-csv',
-                           help='Solution matrix names to be exported to csv (e.g. ...="U,E2")')
+                           help='Solution matrix names to be exported (e.g. ...="U,E2") (see --export-format)')
+        group.add_argument('--export-format',
+                           default='csv',
+                           choices=['csv', 'npy', 'npz'],
+                           help='Format of --export-csv: csv text, npy binary file per matrix '
+                                'or npz archive "<ID>.solution.npz" of all matrices')
         group.add_argument('-C', '--compress-csv',
                            action='store_true',
-                           help='Compress csv files with bz2')
+                           help='Compress csv files with bz2 (npz archives with zlib) (see --compress-codec)')
+        group.add_argument('--compress-codec',
+                           default='bz2',
+                           choices=['bz2', 'gz'],
+                           help='Codec of --compress-csv: bz2 or gz (zlib, several times faster, larger files)')
+        group.add_argument('--checkpoint-every',
+                           type=int,
+                           help='Writes a checkpoint "<ID>.checkpoint.npz" every n steps (see --resume)')
+        group.add_argument('--checkpoint-minutes',
+                           type=float,
+                           help='Writes a checkpoint "<ID>.checkpoint.npz" every m wall-clock minutes (see --resume)')
+        group.add_argument('--spill-timedata',
+                           action='store_true',
+                           help='Keeps the time data in the memory-mapped file "<ID>.timedata.npy" instead of RAM '
+                                '(long runs, rows survive a crash)')
         group.add_argument('--update-every',
                            type=int,
                            help='Every n simulation steps data is plotted or rendered (>=2) (slowdown).')
+        group.add_argument('--sync-view',
+                           action='store_true',
+                           help='Renders live plots of --update-every in the simulation process (waits for every '
+                                'update, default: separate process dropping updates when it lags)')
         group.add_argument('--no-diagrams',
                            action='store_true',
                            help='No diagrams or axes, it only renders the image map of U.')
@@ -125,21 +232,48 @@ class CLIParser:
         if self.args.kappa_tilde is not None:
             params.kappa_tilde = self.args.kappa_tilde
         params.compress_csv = self.args.compress_csv
+        params.compress_codec = self.args.compress_codec
         params.export_csv = self.args.export_csv
+        params.export_format = self.args.export_format
         params.png = self.args.png
+        params.png_renderer = self.args.png_renderer
         params.png_anim = self.args.png_anim
+        params.png_anim_processes = self.args.png_anim_processes
         params.yaml = self.args.yaml
         params.no_gui = self.args.no_gui
         params.adaptive_time = self.args.adaptive_time
+        params.adaptive_tol = self.args.adaptive_tol
+        params.delt_max = self.args.dt_max
+        params.delt_ladder = self.args.dt_ladder
         params.time_max = self.args.time_max
+        params.wall_max = self.args.wall_max
+        params.checkpoint_every = self.args.checkpoint_every
+        params.checkpoint_minutes = self.args.checkpoint_minutes
+        params.resume = self.args.resume
+        params.spill_timedata = self.args.spill_timedata
         params.generator = self.args.generator
         params.jitter = self.args.jitter
         params.update_every = self.args.update_every
         params.no_diagrams = self.args.no_diagrams
+        params.async_view = not self.args.sync_view
         params.Uinit_file = self.args.Uinit_file
+        params.Uinit_cache = self.args.Uinit_cache
+        params.fft_backend = self.args.fft_backend
+        params.fft_workers = self.args.fft_workers
+        params.blas_threads = self.args.blas_threads
+        params.precision = self.args.precision
+        params.diag_every = self.args.diag_every
+        params.spectral_energy = self.args.spectral_energy
+        params.integrator = self.args.integrator
+        params.stabilization = self.args.stabilization
+        params.warm_start = self.args.warm_start
+        params.warm_time = self.args.warm_time
+        params.warm_energy = self.args.warm_energy
+        params.metrics = None if self.args.metrics.lower() == 'all' else self.args.metrics
         params.XXX = self.get_if_range_ok(self.args.cinit, lower=0.85, upper=0.95, name='cinit')
         params.threshold = self.get_if_range_ok(self.args.threshold, lower=0.85, upper=0.95, name='threshold')
-        params.delt = self.get_if_range_ok(self.args.dt, lower=1e-12, upper=1e-6, name='dt')
+        params.delt = self.get_if_range_ok(self.args.dt, lower=1e-12,
+                                           upper=1e-6 if params.integrator == 'semi-implicit' else 2e-6, name='dt')
         if self.args.temperature is not None:
             params.temp = self.args.temperature
 
@@ -147,10 +281,53 @@ class CLIParser:
             self.parser.error('--update-every should be >=2')
         if params.png_anim and params.update_every is None:
             self.parser.error("--png-anim requires --update-every.")
+        if params.png_anim_processes == 0:
+            self.parser.error('--png-anim-processes must not be 0.')
         if params.export_csv is not None and (params.export_csv == '' or params.export_csv.lower() == 'none'):
             self.parser.error("--export-csv does not contain valid entries.")
+        if params.checkpoint_every is not None and params.checkpoint_every < 1:
+            self.parser.error('--checkpoint-every should be >=1')
+        if params.checkpoint_minutes is not None and params.checkpoint_minutes <= 0:
+            self.parser.error('--checkpoint-minutes should be >0')
+        if params.resume is not None and not os.path.isfile(params.resume):
+            self.parser.error(f"--resume: checkpoint file '{params.resume}' not found.")
+        if params.diag_every < 1:
+            self.parser.error('--diag-every should be >=1')
+        if params.stabilization is not None and params.stabilization < 0:
+            self.parser.error('--stabilization should be >=0')
+        if params.warm_time is not None and params.warm_time <= 0:
+            self.parser.error('--warm-time should be >0')
+        if params.warm_energy <= 1:
+            self.parser.error('--warm-energy should be >1')
+        if params.N % params.warm_start != 0:
+            self.parser.error('--warm-start must divide N')
+        if params.adaptive_tol <= 0:
+            self.parser.error('--adaptive-tol should be >0')
+        if params.delt_ladder < 0:
+            self.parser.error('--dt-ladder should be >=0')
+        if params.delt_max < params.delt:
+            self.parser.error('--dt-max should be >=dt')
+        if params.adaptive_time and params.integrator == 'bdf2':
+            self.parser.error('--adaptive-time requires a one-step --integrator (not bdf2)')
+        try:
+            TimeData.parse_metrics(params.metrics)
+        except ValueError as e:
+            self.parser.error(f"--metrics: {e}")
+        if params.fft_workers == 0:
+            self.parser.error('--fft-workers must not be 0.')
+        if params.blas_threads == 0:
+            self.parser.error('--blas-threads must not be 0.')
+        if params.wall_max is not None and params.wall_max <= 0:
+            self.parser.error('--wall-max should be >0')
+        if params.fft_backend == 'pyfftw' and not utils.module_exists('pyfftw'):
+            self.parser.error("--fft-backend=pyfftw requires the pyfftw package.")
         if params.compress_csv and params.export_csv is None:
             self.parser.error("--compress-csv has no effect (no --export-csv given).")
+        if params.compress_csv and params.export_format == 'npy':
+            self.parser.error("--compress-csv has no effect with --export-format=npy "
+                              "(npz is the compressed binary format).")
+        if params.spectral_energy and params.jitter is not None:
+            self.parser.error("--spectral-energy has no effect with --jitter (noise is added to U, not to its DCT).")
 
         if self.args.parameter_file is not None:
             params.yaml_import_scalars(self.args.parameter_file)
@@ -1,23 +1,31 @@
 #!/usr/bin/env python
+import os
+# https://matplotlib.org/stable/users/faq/howto_faq.html#work-with-threads
+# (set before matplotlib is imported, also inherited by the worker processes)
+os.environ['MPLBACKEND'] = 'Agg'
+
+import json
+import time
 import numpy as np
-import pandas as pd
-from scipy.stats import qmc
 import multiprocessing as mp
-from tqdm import tqdm
 
+from . import thermo
 from . import utils
 from .cli_parser import CLIParser
 from .simulator import Simulator
-
-import matplotlib
-# https://matplotlib.org/stable/users/faq/howto_faq.html#work-with-threads
-matplotlib.use('Agg')
+from .solution import Solution
+from .ensemble import EnsembleSolver
 
 init_params = None  # global as multiprocessing pool cannot pickle Parameters because of lambda
 rand_values = None  # global ndarray of random numbers, for multi-process access
 U_init = None
 A_list = None  # list of A0, A1 values if --A-file is used
 
+RESULT_COLUMNS = ('A0', 'A1', 'ca', 'cb', 'sa', 'sb', 'tau0', 't0', 'tsep', 'id', 'fac_A0', 'fac_A1', 'walltime',
+                  'stop_reason')
+JOURNAL_SUFFIX = '-journal.jsonl'
+STRAGGLER_FACTOR = 2.0  # runs taking longer than this factor times the median wall time are reported
+
 
 class ExperimentParams:
     def __init__(self):
@@ -28,6 +36,9 @@ class ExperimentParams:
         self.independent = False
         self.A_source = 'uniform'
         self.A_seed = None  # seed for RNG based A0, A1 generation
+        self.batch = 1  # runs advanced together in one ensemble stack per process
+        self.resume = None  # journal file of an interrupted experiment
+        self.schedule = 'cost'  # order of the runs: cost (predicted most expensive first) or id
 
 
 # parsing command-line-interface arguments
@@ -57,6 +68,15 @@ class ExperimentCLIParser:
                            default=85972,
                            type=int,
                            help='RNG seed for generating random A0, A1 (if --A-source is not file-based)')
+        group.add_argument('-B', '--batch',
+                           default=1,
+                           type=int,
+                           help='Number of runs advanced together as one ensemble (batched arrays) per process '
+                                '(faster for small N, e.g. 2x for N=32, slower for N>=256, see examples/benchmark.py -B)')
+        group.add_argument('--schedule',
+                           default='cost',
+                           choices=['cost', 'id'],
+                           help='Order in which runs are started: predicted most expensive first (cost) or by run id')
 
     def get_parameters(self):
         params = self.cliparser.get_parameters()
@@ -68,7 +88,7 @@ class ExperimentCLIParser:
         params.yaml = True
         if self.cliparser.args.export_csv is None:
             params.export_csv = 'U, E, E2, SA'
-            params.compress_csv = True
+            params.compress_csv = params.export_format != 'npy'  # npy files are not compressed
         else:
             params.export_csv = self.cliparser.args.export_csv
             params.compress_csv = self.cliparser.args.compress_csv
@@ -78,11 +98,88 @@ class ExperimentCLIParser:
             self.cliparser.parser.error('ERROR: --png-anim is not allowed.')
         exp_params.processes = self.cliparser.args.processes
         exp_params.A_seed = self.cliparser.args.A_seed
+        exp_params.batch = self.cliparser.args.batch
+        exp_params.schedule = self.cliparser.args.schedule
+        if exp_params.batch < 1:
+            self.cliparser.parser.error('ERROR: --batch must be at least 1.')
+        if exp_params.batch > 1 and (params.adaptive_time or params.jitter is not None):
+            self.cliparser.parser.error('ERROR: --batch does not support --adaptive-time or --jitter.')
+        # --resume continues the experiment of a journal (the runs themselves are not resumed from checkpoints)
+        if params.resume is not None:
+            if not params.resume.endswith(JOURNAL_SUFFIX):
+                self.cliparser.parser.error(f"ERROR: --resume expects an experiment journal '<ID>{JOURNAL_SUFFIX}'.")
+            exp_params.resume = params.resume
+            params.resume = None
+            params.file_id = exp_params.resume[:-len(JOURNAL_SUFFIX)]
         return exp_params, params
 
 
-def run_experiment(run_id):
-    global init_params, rand_values, U_init, A_list
+class Journal:
+    def __init__(self, fname):
+        """Experiment journal, one JSON line per finished run (the first line describes the experiment)
+
+        Results are appended as soon as they arrive, so an interrupted experiment can be resumed (--resume).
+        """
+        self.fname = fname
+        self.file = None
+
+    def create(self, header):
+        self.file = open(self.fname, 'w')
+        self._write([header])
+
+    def read(self):
+        """Returns the header and the results of the journal and opens it for appending
+
+        An incomplete last line (interrupted write) is cut off.
+        """
+        with open(self.fname, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        lines = data[:end].decode().splitlines()
+        if len(lines) == 0:
+            raise ValueError(f"Journal '{self.fname}' has no header.")
+        header = json.loads(lines[0])
+        results = [tuple(json.loads(line).get(col) for col in RESULT_COLUMNS) for line in lines[1:]]
+        self.file = open(self.fname, 'a')
+        return header, results
+
+    def append(self, results):
+        self._write([dict(zip(RESULT_COLUMNS, result)) for result in results])
+
+    def _write(self, records):
+        # one write per batch, flushed to disk before the next batch is awaited
+        self.file.write(''.join(json.dumps(record, default=_json_default) + '\n' for record in records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def journal_header(exp_params, params):
+    """Settings which define the runs of an experiment, a resumed experiment has to match them"""
+    return {'experiment': {'runs': exp_params.runs,
+                           'independent': exp_params.independent,
+                           'A_source': exp_params.A_source,
+                           'A_seed': exp_params.A_seed,
+                           'jitter_Arellow': exp_params.jitter_Arellow,
+                           'jitter_Arelhigh': exp_params.jitter_Arelhigh,
+                           'N': params.N,
+                           'seed': params.seed}}
+
+
+def run_params(run_id):
+    global init_params, rand_values, A_list
     # prepare params for actual run
     params = init_params.deepcopy()
     params.seed = init_params.seed
@@ -99,18 +196,58 @@ def run_experiment(run_id):
         params.func_A1 = lambda temp: A_list[run_id][1]
         fac_A0 = None
         fac_A1 = None
+    return params, fac_A0, fac_A1
 
-    # sim simulator
-    simulator = Simulator(params, U_init)  # U_init is global, set in __main__
-    # solve
-    solution = simulator.solve()
 
-    simulator.export()
-    simulator.render()
+def run_costs(run_ids):
+    """Returns the predicted relative costs of runs, the time scale 4 kappa / G''(XXX)^2 of phase separation
+
+    Modes of the nearly uniform initial field grow at most at the rate M G''^2 / (4 kappa) (linear stability),
+    the number of steps until the energy falls scales with its inverse. Runs outside the spinodal (G'' >= 0)
+    are predicted to be the most expensive (inf).
+    """
+    global init_params, rand_values, A_list
+    params = init_params
+    run_ids = np.asarray(run_ids, dtype=int)
+    if A_list is None:
+        A0 = utils.A0(params.temp) * rand_values[run_ids, 0]
+        A1 = utils.A1(params.temp) * rand_values[run_ids, 1]
+    else:
+        A0 = A_list[run_ids, 0]
+        A1 = A_list[run_ids, 1]
+    if params.kappa_tilde is None:
+        # proportional to kappa_tilde of Solution (constant factors do not change the order)
+        kappa = thermo.distance_common_tangent(params.R, params.temp, params.B, A0, A1, at=params.XXX)
+    else:
+        kappa = params.kappa_tilde
+    G2 = thermo.gibbs_second_derivative(params.XXX, params.R * params.temp, A0, A1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        costs = np.where(G2 < 0, 4 * kappa / G2 ** 2, np.inf)
+    return np.where(np.isnan(costs), np.inf, costs)
+
+
+def report_stragglers(df_results, costs=None):
+    """Prints the runs which hit the wall-clock limit or took more than STRAGGLER_FACTOR times the median"""
+    walltime = df_results['walltime']
+    stragglers = df_results[(df_results['stop_reason'] == 'wall-limit') |
+                            (walltime > STRAGGLER_FACTOR * walltime.median())]
+    if len(stragglers) == 0:
+        return stragglers
+    stragglers = stragglers[['id', 'A0', 'A1', 'tau0', 'walltime', 'stop_reason']].copy()
+    if costs is not None:
+        # rank 1 = predicted most expensive run
+        ranks = {run_id: rank + 1 for rank, run_id in enumerate(sorted(costs, key=lambda i: -costs[i]))}
+        stragglers['cost_rank'] = [ranks.get(run_id) for run_id in stragglers['id']]
+    print(f"Stragglers ({len(stragglers)} of {len(df_results)} runs, median wall time {walltime.median():.2f}s):")
+    print(stragglers.to_string(index=False))
+    return stragglers
+
+
+def run_result(run_id, params, solution, fac_A0, fac_A1, walltime):
     cgap = utils.get_miscibility_gap(params.R, params.temp, params.B,
                                      solution.A0, solution.A1)
     sa, sb = utils.get_roots_of_EPP(params.R, params.temp, solution.A0, solution.A1)
-    itargmax = np.argmax(solution.E2)
+    itargmax = int(solution.it_range[np.nanargmax(solution.E2)])  # time data might be decimated (--diag-every)
     return (solution.A0,
             solution.A1,
             cgap[0],  # c_A
@@ -122,13 +259,57 @@ def run_experiment(run_id):
             itargmax,  # tsep in iterations
             run_id,  # run number
             fac_A0,
-            fac_A1
+            fac_A1,
+            # wall-clock seconds, batched runs: shared ensemble solve plus own export and render,
+            # i.e. not comparable with walltime of --batch 1 (compare the total time of the experiment instead)
+            walltime,
+            solution.stop_reason
             )
 
 
+def run_experiment(run_id):
+    global U_init
+    params, fac_A0, fac_A1 = run_params(run_id)
+    start = time.perf_counter()
+    # sim simulator
+    simulator = Simulator(params, U_init)  # U_init is global, set in __main__
+    # solve
+    solution = simulator.solve()
+
+    simulator.export()
+    simulator.render()
+    return run_result(run_id, params, solution, fac_A0, fac_A1, time.perf_counter() - start)
+
+
+def run_experiment_batch(run_ids):
+    """Runs several runs as one ensemble (batched arrays), returns list of results"""
+    global U_init
+    if len(run_ids) == 1:
+        return [run_experiment(run_ids[0])]
+    start = time.perf_counter()
+    runs = [run_params(run_id) for run_id in run_ids]
+    simulators = [Simulator(params, U_init) for params, _, _ in runs]
+    with simulators[0].blas_limit():
+        EnsembleSolver([simulator.solver for simulator in simulators]).solve()
+    solve_time = time.perf_counter() - start  # shared by all members
+    results = []
+    for run_id, (params, fac_A0, fac_A1), simulator in zip(run_ids, runs, simulators):
+        start = time.perf_counter()
+        simulator.solution_file_id = utils.get_or_create_file_id(params.file_id)
+        simulator.export()
+        simulator.render()
+        results.append(run_result(run_id, params, simulator.solver.solution, fac_A0, fac_A1,
+                                  solve_time + time.perf_counter() - start))
+    return results
+
+
 def main():
     global init_params, rand_values, U_init, A_list
     mp.freeze_support()  # for Windows support
+    # only the main process needs these (workers import this module, too)
+    import pandas as pd
+    from scipy.stats import qmc
+    from tqdm import tqdm
     exp_cliparser = ExperimentCLIParser()
     exp_cliparser.cliparser.print_info()
     exp_params, init_params = exp_cliparser.get_parameters()
@@ -143,7 +324,7 @@ def main():
     if init_params.Uinit_file is None:
         U_init = None
     else:
-        U_init = utils.csv_import_matrix(init_params.Uinit_file)
+        U_init = utils.import_matrix(init_params.Uinit_file, mmap_mode='r')
 
     if 'uniform' == exp_params.A_source or 'sobol' == exp_params.A_source:
         rtemp = None
@@ -195,40 +376,88 @@ def main():
                                   "\n".join(sysinfo_list + exp_params_list))
     # prepare for multiprocessing
     nprocs = 1
+    cores = utils.get_number_physical_cores()
+    fft_threads = cores if init_params.fft_workers < 1 else init_params.fft_workers
+    # pool size is limited by the available memory (estimated peak per process)
+    nprocs_mem = max(1, int(utils.get_mem_available() //
+                            utils.estimate_run_memory(init_params.N, exp_params.batch, init_params.precision)))
     if exp_params.processes == -1:
-        nprocs = utils.get_number_physical_cores()
+        nprocs = max(1, cores // fft_threads)  # processes x FFT threads = physical cores
         nprocs = min(exp_params.runs, nprocs)  # e.g. one run only needs one core
+        if nprocs_mem < nprocs:
+            print(f"Memory limits the number of processes to {nprocs_mem} (instead of {nprocs}).")
+            nprocs = nprocs_mem
     elif exp_params.processes > 1:
         nprocs = exp_params.processes
+        if nprocs_mem < nprocs:
+            print(f"WARNING: {nprocs} processes might exceed the available memory (estimated {nprocs_mem}).")
 
     nr_items = rand_values.shape[0] if A_list is None else A_list.shape[0]
     if exp_params.independent and ('sobol' == exp_params.A_source or 'uniform' == exp_params.A_source):
         nr_items = min(2 * exp_params.runs, nr_items)
     else:
         nr_items = min(exp_params.runs, nr_items)
-    items = range(nr_items)
+    # finished runs are journaled, a resumed experiment skips them
+    journal = Journal(f"{init_params.file_id}{JOURNAL_SUFFIX}")
+    header = journal_header(exp_params, init_params)
     results = []
-    with mp.Pool(processes=nprocs) as pool, tqdm(pool.imap_unordered(run_experiment, items), total=len(items)) as pbar:
-        pbar.set_postfix({'Mem': utils.get_mem_usage_all()})
-        for x in pbar:
+    if exp_params.resume is None:
+        journal.create(header)
+    else:
+        journal_header_old, results = journal.read()
+        if journal_header_old != header:
+            journal.close()
+            exp_cliparser.cliparser.parser.error(f"ERROR: --resume: experiment settings differ from the journal "
+                                                 f"({journal_header_old['experiment']}).")
+    done = {result[RESULT_COLUMNS.index('id')] for result in results}
+    todo = [run_id for run_id in range(nr_items) if run_id not in done]
+    costs = None
+    if exp_params.schedule == 'cost':
+        # longest (predicted) runs first, so short runs fill the cores at the end,
+        # batches are made of runs with similar costs
+        costs = dict(zip(todo, run_costs(todo)))
+        todo.sort(key=lambda run_id: -costs[run_id])
+    items = [todo[i:i + exp_params.batch] for i in range(0, len(todo), exp_params.batch)]
+    nprocs = max(1, min(nprocs, len(items)))
+    # csv compression threads of each process: its share of the cores
+    init_params.export_workers = max(1, cores // nprocs)
+    # warm the process-wide coefficient cache before forking, workers share its read-only pages
+    # (CHeig/Seig only if kappa_tilde is fixed, otherwise it depends on A0/A1 of each run)
+    utils.get_eigenvalues(init_params.N)
+    if init_params.kappa_tilde is not None:
+        Solution(init_params)
+    try:
+        with mp.Pool(processes=nprocs) as pool, tqdm(total=nr_items, initial=len(results)) as pbar:
             pbar.set_postfix({'Mem': utils.get_mem_usage_all()})
-            results.append(x)
-            pbar.refresh()
+            for x in pool.imap_unordered(run_experiment_batch, items):
+                pbar.set_postfix({'Mem': utils.get_mem_usage_all()})
+                journal.append(x)
+                results.extend(x)
+                pbar.update(len(x))
+    finally:
+        journal.close()
 
-    cols = ['A0', 'A1', 'ca', 'cb', 'sa', 'sb', 'tau0', 't0', 'tsep', 'id', 'fac_A0', 'fac_A1']
-    df_results = pd.DataFrame(results, columns=cols)
+    # aggregates are built from all journaled runs
+    df_results = pd.DataFrame(results, columns=RESULT_COLUMNS).sort_values('id', ignore_index=True)
     df_results[['tau0', 'id']] = df_results[['tau0', 'id']].astype(int)
     df_results.to_csv(f"{init_params.file_id}-results.csv")
     df_agg = df_results.loc[:, df_results.columns != 'id'].describe()
     df_agg.loc['cv'] = df_agg.loc['std'] / df_agg.loc['mean']
     print(df_agg.T)
     df_agg.T.to_csv(f"{init_params.file_id}-results-agg.csv")
+    report_stragglers(df_results, costs)
     print('Output files:')
     print(f"  {init_params.file_id}-metadata.csv")
     print(f"  {init_params.file_id}-results-agg.csv")
     print(f"  {init_params.file_id}-results.csv")
+    print(f"  {journal.fname}")
     print(f"  {{{init_params.file_id}-run***.solution.yaml}}")
-    print(f"  {{{init_params.file_id}-run***.solution.*.(csv|bz2)}}")
+    if init_params.export_format == 'npz':
+        print(f"  {{{init_params.file_id}-run***.solution.npz}}")
+    elif init_params.export_format == 'npy':
+        print(f"  {{{init_params.file_id}-run***.solution.*.npy}}")
+    else:
+        print(f"  {{{init_params.file_id}-run***.solution.*.(csv|{init_params.compress_codec})}}")
     if init_params.png:
         print(f"  {{{init_params.file_id}-run***.png}}")
 
@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 
 from matplotlib import pyplot as plt
@@ -6,7 +8,7 @@ import matplotlib
 
 from . import utils
 
-if utils.is_notebook() is False and utils.module_exists('PyQt5'):
+if utils.is_notebook() is False and utils.module_exists('PyQt5') and 'MPLBACKEND' not in os.environ:
     matplotlib.use("Qt5Agg")  # much faster GUI response time
 
 
@@ -30,7 +32,9 @@ class MapView:
                                      clear=True)
         self.ax_Umap = axs
 
-        self.Umap = self.ax_Umap.imshow(np.zeros((N, N)), cmap="plasma", aspect="equal", vmin=0.75, vmax=1.0)
+        # colormap for Umap
+        cmap = colors.LinearSegmentedColormap.from_list('mylist', ['orange', 'yellow'], N=25)
+        self.Umap = self.ax_Umap.imshow(np.zeros((N, N)), cmap=cmap, aspect="equal", vmin=0.75, vmax=1.0)
         self.ax_Umap.axis('off')
         self.title = None
         if self.imode_defaulted:
@@ -40,9 +44,6 @@ class MapView:
         self.ax_Umap.set_title('')
         if U is None:
             return
-        # colormap for Umap
-        cmap = colors.LinearSegmentedColormap.from_list('mylist', ['orange', 'yellow'], N=25)
-        self.Umap.set_cmap(cmap)
         self.Umap.set_clim(vmin=np.min(U), vmax=np.max(U))
         # self.Umap.set_norm(norm)
         Ureal = np.real(U)
@@ -12,6 +12,26 @@ def _lcg(x, a, c, m):
         yield x
 
 
+def _lcg_sequence(n, x, a, c, m):
+    """Returns the first n values of the LCG as array (same values as _lcg)
+
+    In float64 the products a * x are rounded, so the sequence runs into a short cycle
+    (e.g. seed 2023: period 10466 after 3781 values). Values are generated until the first
+    repeated state, the rest of the sequence is the repeated cycle.
+    """
+    x, a, c, m = float(x), float(a), float(c), float(m)  # same IEEE arithmetic, faster than numpy scalars
+    values = []
+    seen = {}
+    for i in range(n):
+        x = (a * x + c) % m
+        j = seen.setdefault(x, i)
+        if j != i:  # x_i == x_j, so x_{i+k} == x_{j+k} for all k
+            cycle = np.array(values[j:])
+            return np.concatenate((values, np.resize(cycle, n - i)))
+        values.append(x)
+    return np.array(values, dtype=np.float64)
+
+
 def matlab_lcg_sample(n1, n2, seed):
     """Returns a n1 x n2 matrix with pseudo-random values on [0,1) by using a linear-congruential-generator and seed
 
@@ -20,13 +40,8 @@ def matlab_lcg_sample(n1, n2, seed):
     a = np.float64(1103515245)
     c = np.float64(12345)
     m = np.float64(2 ** 31)
-    bsdrand = _lcg(seed, a, c, m)
-
-    sample = np.zeros((n1, n2))
-    # column-major looping like matlab
-    for i in range(n1*n2):
-        observation = next(bsdrand)
-        sample[int(i % n1), int(i / n1)] = observation
+    # column-major like matlab
+    sample = np.ascontiguousarray(_lcg_sequence(n1 * n2, seed, a, c, m).reshape((n2, n1)).T)
 
     sample /= (m - 1)
     return sample
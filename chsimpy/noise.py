@@ -0,0 +1,87 @@
+"""
+Jitter noise produced ahead of time, so the solver only adds a prepared field per step
+
+"""
+
+import queue
+import threading
+
+import numpy as np
+
+
+class NoiseProvider:
+    def __init__(self, create_rand, N, factor, depth=3, constant=False, get_state=None):
+        """Provides jitter fields factor * (2 * create_rand(N) - 1) for consecutive steps
+
+        Fields are produced by a background thread into a ring of depth preallocated buffers,
+        strictly in the order of the stream of create_rand, so runs stay reproducible.
+        If constant, create_rand always returns the same values (e.g. simplex noise)
+        and the field is computed once.
+        get_state() returns the position in the stream of create_rand, see state().
+        """
+        self.N = N
+        self.factor = factor
+        self.constant = constant
+        self._create_rand = create_rand
+        self._get_state = get_state
+        self._buffers = [np.empty((N, N)) for _ in range(1 if constant else depth)]
+        self._states = [None] * len(self._buffers)  # stream position after the field of each buffer
+        self._state = None if get_state is None else get_state()
+        self._free = queue.Queue()  # buffer indices to be filled by the producer
+        self._full = queue.Queue()  # filled buffer indices in stream order
+        self._current = None
+        self._thread = None
+        if constant:
+            self._fill(0)
+        else:
+            for i in range(depth):
+                self._free.put(i)
+
+    def _fill(self, i):
+        buffer = self._buffers[i]
+        np.multiply(self._create_rand(self.N), 2, out=buffer)
+        buffer -= 1
+        buffer *= self.factor
+        if self._get_state is not None:
+            self._states[i] = self._get_state()
+
+    def _produce(self):
+        while True:
+            i = self._free.get()
+            if i is None:
+                return
+            try:
+                self._fill(i)
+            except BaseException as e:  # re-raised by next()
+                self._full.put(e)
+                return
+            self._full.put(i)
+
+    def next(self):
+        """Returns the jitter field of the next step (valid until the next call)"""
+        if self.constant:
+            return self._buffers[0]
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._produce, name='chsimpy-noise', daemon=True)
+            self._thread.start()
+        if self._current is not None:
+            self._free.put(self._current)  # the previous field was consumed
+        i = self._full.get()
+        if isinstance(i, BaseException):
+            raise i
+        self._current = i
+        self._state = self._states[i]
+        return self._buffers[i]
+
+    def state(self):
+        """Returns the stream position after the last consumed field (fields produced ahead are not counted)
+
+        Restarting a provider at this position continues the sequence of next(). None without get_state.
+        """
+        return self._state
+
+    def close(self):
+        """Stops the producer thread (fields already produced are dropped)"""
+        if self._thread is not None:
+            self._free.put(None)
+            self._thread = None
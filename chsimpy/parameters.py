@@ -34,7 +34,10 @@ class Parameters:
         self.N_A = 6.02214076e+23  # and with the Avogadro constant [particles per mole]
 
         self.delt = 3e-8
-        self.delt_max = 9e-8
+        self.delt_min = 1e-12  # bounds of the adaptive time stepping
+        self.delt_max = 2e-6  # larger adaptive steps lose accuracy of t0
+        self.adaptive_tol = 1e-4  # tolerated local error (RMS of U) per step of the adaptive time stepping
+        self.delt_ladder = 4  # adaptive delt is rounded to delt_max * 2^(-j/delt_ladder) (0 = no rounding)
         self.M_tilde = 1.71e-8  # mobility factor [µm^2/(kJ * s)]
         self.kappa_tilde = None # None = will be computed
 
@@ -42,14 +45,24 @@ class Parameters:
         self.ntmax = int(1e6)  # stops earlier when energy falls
 
         self.export_csv = None  # e.g. 'U,E2'
+        self.export_format = 'csv'  # csv, npy (one file per matrix) or npz (one archive)
         self.png = False
         self.png_anim = False
+        self.png_renderer = 'auto'  # matplotlib, lut (map of U only, no figure) or auto (lut if no_gui and no_diagrams)
+        self.png_anim_processes = -1  # processes rendering the spooled --png-anim frames (-1 = physical cores)
         self.yaml = False
         self.no_gui = False
         self.file_id = 'auto'  # id for filenames (solution, parameters)
         self.full_sim = False
         self.compress_csv = False
+        self.compress_codec = 'bz2'  # codec of compress_csv: bz2 or gz (zlib, faster, see utils.CSV_CODECS)
+        self.export_workers = 2  # threads compressing csv exports (-1 = physical cores)
         self.time_max = None  # time in minutes to simulate (ignores ntmax)
+        self.wall_max = None  # wall-clock minutes a run may take (stop reason 'wall-limit', None = unlimited)
+        self.checkpoint_every = None  # steps between checkpoints '<file_id>.checkpoint.npz' (None = off)
+        self.checkpoint_minutes = None  # wall-clock minutes between checkpoints (None = off)
+        self.spill_timedata = False  # time data in the memory-mapped file '<file_id>.timedata.npy' instead of RAM
+        self.resume = None  # checkpoint file to continue from (parameters are taken from the checkpoint)
         # lcg - linear congruential generator for reproducible portable random numbers
         # sobol - quasi-random numbers
         # simplex - simplex noise
@@ -57,8 +70,22 @@ class Parameters:
         self.adaptive_time = False
         self.jitter = None
         self.update_every = 100  # update and renders every 100 steps
+        self.async_view = True  # interactive live plots are rendered by a separate process (drops frames if it lags)
         self.no_diagrams = False
         self.Uinit_file = None
+        self.Uinit_cache = None  # directory of cached generated U_init fields (None = no cache)
+        self.fft_backend = 'scipy'  # scipy, fftpack (legacy, single-threaded) or pyfftw (if installed)
+        self.fft_workers = 1  # threads per DCT (-1 = all cores)
+        self.blas_threads = 1  # threads of BLAS libraries (threadpoolctl limit, -1 = no limit)
+        self.precision = 'float64'  # float64 or float32 (fields and DCTs, diagnostics are always float64)
+        self.diag_every = 1  # metrics are computed every n steps
+        self.metrics = None  # metrics to compute, e.g. 'E2,SA' (None = all)
+        self.spectral_energy = False  # E2 from DCT coefficients (Laplacian of the solver) instead of np.gradient
+        self.warm_start = 1  # coarsening factor of the progressive-resolution warm start (1 = off, 2 or 4)
+        self.warm_time = None  # warm start: physical time [s] on the coarse grid (None = energy criterion)
+        self.warm_energy = 2.0  # warm start: switch when E2 rose to warm_energy times its minimum
+        self.integrator = 'semi-implicit'  # semi-implicit, stabilized, bdf2 or etdrk2 (see integrators.py)
+        self.stabilization = None  # S of stabilized integrators (None = max(-G'')/2 in the miscibility gap)
 
         self.func_A0 = lambda temp: utils.A0(temp)
         self.func_A1 = lambda temp: utils.A1(temp)
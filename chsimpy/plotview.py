@@ -1,14 +1,15 @@
+import os
+
 import numpy as np
 
 from matplotlib import pyplot as plt
 from matplotlib import colors
 import matplotlib
-import seaborn as sns
 
 from . import utils
 
 
-if utils.is_notebook() is False and utils.module_exists('PyQt5'):
+if utils.is_notebook() is False and utils.module_exists('PyQt5') and 'MPLBACKEND' not in os.environ:
     matplotlib.use("Qt5Agg")  # much faster GUI response time
 
 
@@ -160,11 +161,27 @@ class PlotView:
         if U is None:
             return
         Ureal = np.real(U)
-        self.ax_Uhist.cla()
-        # ravel gives 1D view on data
-        self.Uhist = sns.histplot(data=Ureal.ravel(), stat='probability', ax=self.ax_Uhist, bins=self.bins)
-        self.ax_Uhist.set_title(title)
-        self.ax_Uhist.set_xlabel('Concentration')
+        # probabilities of equal-width bins over the value range (one counting pass, no artists are recreated)
+        try:
+            counts, edges = np.histogram(Ureal, bins=self.bins)
+        except ValueError:  # non-finite values
+            counts, edges = np.histogram(Ureal[np.isfinite(Ureal)], bins=self.bins)
+        heights = counts / max(counts.sum(), 1)
+        widths = np.diff(edges)
+        if self.Uhist is None:
+            self.Uhist = self.ax_Uhist.bar(edges[:-1], heights, width=widths, align='edge',
+                                           color=colors.to_rgba('C0', 0.75), edgecolor='black', linewidth=1)
+            self.ax_Uhist.set_title(title)
+            self.ax_Uhist.set_xlabel('Concentration')
+            self.ax_Uhist.set_ylabel('Probability')
+        else:
+            for bar, x, width, height in zip(self.Uhist, edges[:-1], widths, heights):
+                bar.set_x(x)
+                bar.set_width(width)
+                bar.set_height(height)
+        margin = 0.05 * (edges[-1] - edges[0])
+        self.ax_Uhist.set_xlim(edges[0] - margin, edges[-1] + margin)
+        self.ax_Uhist.set_ylim(0, 1.05 * max(heights.max(), 1e-12))
 
     def imode_on(self):
         plt.ion()
@@ -236,7 +253,8 @@ class PlotView:
             # redraw just the points
             self.ax_Eline.draw_artist(self.Eline)
             self.ax2_Eline.draw_artist(self.ElineDelt)
-            self.ax_Uhist.draw_artist(self.Uhist)
+            for bar in self.Uhist:
+                self.ax_Uhist.draw_artist(bar)
             self.ax_Uline.draw_artist(self.Uline)
             self.ax_Umap.draw_artist(self.Umap)
             self.ax_SAlines.draw_artist(self.SAlines[0])
@@ -0,0 +1,83 @@
+"""
+Headless rendering of the image map of U: values are coloured by a lookup table and written directly to a PNG file,
+no matplotlib figure is created
+
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+
+ORANGE = (255, 165, 0)  # colours of the map in MapView and PlotView
+YELLOW = (255, 255, 0)
+
+
+def threshold_lut():
+    """Colours of U < threshold and U >= threshold (as PlotView.set_Umap)"""
+    return np.array([ORANGE, YELLOW], dtype=np.uint8)
+
+
+def linear_lut(levels=25):
+    """Colours of levels equal-width value ranges between min(U) and max(U) (as MapView.set_Umap)"""
+    weights = np.linspace(0, 1, levels)[:, np.newaxis]
+    first, last = np.array(ORANGE) / 255, np.array(YELLOW) / 255
+    colors = first + weights * (last - first)
+    return (colors * 255).astype(np.uint8)  # truncated as matplotlib colormaps
+
+
+class MapRenderer:
+    def __init__(self, N, mode='linear', levels=25, compresslevel=6):
+        """Writes U as an N x N PNG image with one pixel per grid point
+
+        mode 'threshold' colours U by threshold, mode 'linear' scales U from its minimum to its maximum.
+        The lookup table is the palette of the PNG, so a pixel is stored as the index of its colour.
+        """
+        if mode not in ('threshold', 'linear'):
+            raise ValueError(f"Unknown map mode '{mode}'")
+        self.N = N
+        self.mode = mode
+        self.lut = threshold_lut() if mode == 'threshold' else linear_lut(levels)
+        self.compresslevel = compresslevel
+        # PNG scanlines: filter type byte (0 = none) followed by the pixel indices of a row
+        self._scanlines = np.zeros((N, N + 1), dtype=np.uint8)
+        self._scaled = np.empty((N, N))
+
+    def indices(self, U, threshold=None):
+        """Returns the lookup table indices of U (a view of the scanline buffer)"""
+        Ureal = np.real(U)
+        pixels = self._scanlines[:, 1:]
+        if self.mode == 'threshold':
+            np.greater_equal(Ureal, threshold, out=pixels, casting='unsafe')
+            return pixels
+        lo, hi = np.min(Ureal), np.max(Ureal)
+        levels = len(self.lut)
+        np.subtract(Ureal, lo, out=self._scaled)
+        self._scaled *= levels / (hi - lo) if hi > lo else 0
+        np.clip(self._scaled, 0, levels - 1, out=self._scaled)
+        np.copyto(pixels, self._scaled, casting='unsafe')
+        return pixels
+
+    def render_to(self, U, threshold=None, fname='map.png'):
+        self.indices(U, threshold)
+        write_png(fname, self._scanlines, self.lut, self.compresslevel)
+
+
+def write_png(fname, scanlines, palette, compresslevel=6):
+    """Writes an 8-bit palette PNG, scanlines are rows of pixel indices with a leading filter type byte"""
+    height, width = scanlines.shape[0], scanlines.shape[1] - 1
+    header = struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)  # bit depth 8, palette colours
+    with open(fname, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _write_chunk(f, b'IHDR', header)
+        _write_chunk(f, b'PLTE', np.ascontiguousarray(palette, dtype=np.uint8).tobytes())
+        _write_chunk(f, b'IDAT', zlib.compress(np.ascontiguousarray(scanlines).tobytes(), compresslevel))
+        _write_chunk(f, b'IEND', b'')
+
+
+def _write_chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
@@ -1,59 +1,97 @@
 from threadpoolctl import ThreadpoolController
 import numpy as np
 
+from . import checkpoint
 from . import parameters
-from . import plotview
-from . import mapview
+from . import pngmap
 from . import solver
 from . import utils
+from . import viewer
 
 
 class Simulator:
     threading = ThreadpoolController()
 
-    @threading.wrap(limits=1, user_api='blas')
     def __init__(self, params=None, U_init=None):
         """Simulation simulator"""
         if params is None:
             self.params = parameters.Parameters()
         else:
             self.params = params
-        if U_init is None and params.Uinit_file is not None:
-            U_init = utils.csv_import_matrix(params.Uinit_file)
-        self.solver = solver.Solver(params, U_init)
-        self.steps_total = 0
-        self.solution_file_id = None
-        # only allocate PlotView if required
-        if self.gui_required():
-            if self.params.no_diagrams:
-                self.view = mapview.MapView(self.params.N)
+        with self.blas_limit():
+            self._resume_state = None
+            if self.params.resume is not None:
+                # parameters and field of the checkpointed run (U_init is not used)
+                self._resume_state = checkpoint.load(self.params.resume, self.params)
+                U_init = self._resume_state['U']
+            elif U_init is None and params.Uinit_file is not None:
+                U_init = utils.import_matrix(params.Uinit_file, mmap_mode='r')
+            self.solver = solver.Solver(params, U_init)
+            self.steps_total = 0
+            self.solution_file_id = None
+            # only allocate PlotView if required (matplotlib is only imported then)
+            if self.gui_required():
+                from . import mapview
+                from . import plotview
+                if self.params.no_diagrams:
+                    self.view = mapview.MapView(self.params.N)
+                else:
+                    self.view = plotview.PlotView(self.params.N, self.params.XXX)
             else:
-                self.view = plotview.PlotView(self.params.N, self.params.XXX)
-        else:
-            self.view = None
-            self.params.update_every = None  # no target where update can be applied to
+                self.view = None
+                self.params.update_every = None  # no target where update can be applied to
+
+    def blas_limit(self):
+        """Limits the threads of BLAS libraries to params.blas_threads (context manager, -1 = no limit)"""
+        limits = None if self.params.blas_threads < 1 else self.params.blas_threads
+        return self.threading.limit(limits=limits, user_api='blas')
 
-    @threading.wrap(limits=1, user_api='blas')
     def solve(self):
+        with self.blas_limit():
+            return self._solve()
+
+    def _solve(self):
         # no interactive plotting
         self.solution_file_id = utils.get_or_create_file_id(self.params.file_id)
+        if self.params.checkpoint_every is not None or self.params.checkpoint_minutes is not None:
+            self.solver.checkpointer = checkpoint.Checkpointer(f"{self.solution_file_id}.checkpoint.npz",
+                                                               every=self.params.checkpoint_every,
+                                                               minutes=self.params.checkpoint_minutes)
+        if self.params.spill_timedata:
+            self.solver.timedata_spill = f"{self.solution_file_id}.timedata.npy"
         if self.steps_total == 0:
-            self.solver.prepare()
+            if self._resume_state is None:
+                self.solver.prepare()
+            else:
+                self.solver.restore(self._resume_state)
+                self._resume_state = None
+                self.steps_total = self.solver.solution.computed_steps
         if self.params.update_every is None:
-            return self.solver.solve_or_resume(self.params.ntmax)  # RETURN here, no live-plotting wanted
+            # RETURN here, no live-plotting wanted
+            return self.solver.solve_or_resume(max(self.params.ntmax - self.steps_total, 0))
         #
         # live plotting
         #
-        if self.gui_required():
-            self.view.prepare(show=self.gui_requested())
-        if self.gui_requested():
-            # interactive plotting
-            self.view.imode_on()
-            self.view.show()
+        live = None
+        if self.async_view():
+            # interactive plotting in a separate process, the solver does not wait for it
+            live = viewer.AsyncViewer(self.params, self.solver.metrics)
         else:
-            self.view.imode_off()
+            if self.gui_required():
+                self.view.prepare(show=self.gui_requested())
+            if self.gui_requested():
+                # interactive plotting
+                self.view.imode_on()
+                self.view.show()
+            else:
+                self.view.imode_off()
+
+        # --png-anim frames are spooled to disk and rendered in parallel after the run
+        spool = None
+        if self.params.png_anim:
+            spool = viewer.FrameSpool(f"{self.solution_file_id}.frames.tmp", self.params.N, dtype=self.solver.dtype)
 
-        part = 0
+        part = self.steps_total // self.params.update_every
         steps_end = self.params.ntmax
         if self.params.time_max is not None and self.params.time_max > 0:
             steps_end = utils.get_int_max_value()
@@ -64,14 +102,16 @@ class Simulator:
                 and
                 (self.solver.solution.stop_reason == 'None' or self.params.full_sim is True)
                 and
-                (self.solver.solution.stop_reason != 'time-limit')
+                (self.solver.solution.stop_reason not in ('time-limit', 'wall-limit', 'non-finite'))
         ):
             self.solver.solve_or_resume(dsteps)
-            self._update_view()
-            self.view.draw()
-            if self.params.png_anim:
-                fname = f"{self.solution_file_id}.{part:05d}.png"
-                self.view.render_to(fname)  # includes savefig, which should be called before any plt.show() command
+            if live is not None:
+                live.publish(self.solver.solution)
+            elif self.gui_requested():
+                self._update_view()
+                self.view.draw()
+            if spool is not None:
+                spool.append(part, self.solver.solution)
             self.steps_total += dsteps
             part += 1
             diff = steps_end - self.steps_total
@@ -80,6 +120,15 @@ class Simulator:
             elif diff < 0:
                 raise Exception(f"Something went wrong.")  # diff is negative. steps_end or ntmax is too low
 
+        if live is not None:
+            live.close()
+        if spool is not None:
+            spool.finish(self.solver.solution.timedata)
+            try:
+                viewer.render_frames(spool, self.params, self.solver.metrics, self.solution_file_id,
+                                     processes=self.params.png_anim_processes)
+            finally:
+                spool.remove()
         self.view.finish()
         if self.solver.solution.tau0 == 0:
             self.solver.solution.tau0 = self.solver.solution.computed_steps-1
@@ -87,50 +136,7 @@ class Simulator:
         return self.solver.solution
 
     def _update_view(self):
-        view = self.view
-        params = self.params
-        solution = self.solver.solution
-        if solution.domtime is None:
-            time_total = (1 / (params.M_tilde) * (solution.computed_steps-1) * params.delt)
-        else:
-            time_total = solution.domtime[-1] ** 3
-        view.set_Umap(U=solution.U,
-                      threshold=params.threshold,
-                      title=f"U <> {params.threshold}, total time = {utils.sec_to_min_if(time_total)}, "
-                            f"steps = {solution.computed_steps}")
-        if self.params.no_diagrams:
-            return  # RETURN as mapview only uses U and only renders Umap
-        #
-        #
-        view.set_Uline(U=solution.U, title='Slice at U(N/2,:)')
-
-        if self.params.adaptive_time:
-            view.set_Eline_delt(E=solution.E,
-                                it_range=solution.it_range,
-                                delt=solution.delt,
-                                title='Total Energy',
-                                computed_steps=solution.computed_steps)
-        else:
-            view.set_Eline(E=solution.E,
-                           it_range=solution.it_range,
-                           title='Total Energy',
-                           computed_steps=solution.computed_steps)
-
-        view.set_SAlines(domtime=solution.domtime,
-                         SA=solution.SA,
-                         title=f"Area of high silica (U <> {params.threshold})",
-                         computed_steps=solution.computed_steps,
-                         x2=time_total ** (1 / 3),  # = x2 of x axis
-                         t0=solution.t0)
-
-        view.set_E2line(E2=solution.E2,
-                        it_range=solution.it_range,
-                        title=f"Surf.Energy | Separation t0 = {utils.sec_to_min_if(solution.t0)}",
-                        computed_steps=solution.computed_steps,
-                        tau0=solution.tau0,
-                        t0=solution.t0)
-
-        view.set_Uhist(solution.U, "Solution Histogram")
+        viewer.update_view(self.view, self.params, self.solver.solution, self.solver.metrics)
 
     def export(self):
         fname_sol = f"{self.solution_file_id}.solution"
@@ -141,27 +147,42 @@ class Simulator:
             solution.yaml_export_scalars(fname=fname_sol + '.yaml')
 
         if export_csv is not None:
-            if self.params.compress_csv:
-                fext = 'csv.bz2'
+            export_format = self.params.export_format
+            if export_format == 'npy':
+                fext = 'npy'
+            elif self.params.compress_csv:
+                fext = f"csv.{self.params.compress_codec}"
             else:
                 fext = 'csv'
             members_array = export_csv.replace(' ', '').split(',')
+            matrices = {}
             for member in members_array:
                 varray = None
                 if hasattr(solution, member):
                     varray = getattr(solution, member)
                 if isinstance(varray, np.ndarray):
-                    fname = f"{fname_sol}.{member}.{fext}"
-                    utils.csv_export_matrix(varray, fname=fname)
+                    matrices[member] = varray
+            if export_format == 'npz':
+                # one archive with all members
+                utils.export_matrices(matrices, fname=f"{fname_sol}.npz", compress=self.params.compress_csv)
+            else:
+                for member, varray in matrices.items():
+                    utils.export_matrix(varray, fname=f"{fname_sol}.{member}.{fext}",
+                                        workers=self.params.export_workers)
         return fname_sol
 
     def render(self):
+        if self.headless_png():
+            # map of U colored by a lookup table, no figure is needed
+            mode = 'linear' if self.params.no_diagrams else 'threshold'
+            renderer = pngmap.MapRenderer(self.params.N, mode=mode)
+            renderer.render_to(self.solver.solution.U, self.params.threshold, f"{self.solution_file_id}.png")
         if self.view is None:
             return
         self.view.imode_off()
         if self.gui_required():
             self._update_view()
-        if self.params.png:
+        if self.params.png and not self.headless_png():
             fname = f"{self.solution_file_id}.png"
             self.view.render_to(fname)  # includes savefig, which should be called before any plt.show() command
         if self.gui_requested():
@@ -171,8 +192,20 @@ class Simulator:
     def export_requested(self):
         return self.params.export_csv is not None or self.params.yaml or self.params.png or self.params.png_anim
 
+    def async_view(self):
+        """Interactive live plots are rendered by a separate process (not in notebooks)"""
+        return self.params.async_view and self.gui_requested() and not utils.is_notebook()
+
     def gui_requested(self):
         return self.params.no_gui is False
 
+    def headless_png(self):
+        """--png is rendered by the lookup table renderer of pngmap instead of a figure"""
+        if not self.params.png:
+            return False
+        if self.params.png_renderer == 'auto':
+            return not self.gui_requested() and self.params.no_diagrams
+        return self.params.png_renderer == 'lut'
+
     def gui_required(self):
-        return self.params.png or self.params.png_anim or self.gui_requested()
+        return (self.params.png and not self.headless_png()) or self.params.png_anim or self.gui_requested()
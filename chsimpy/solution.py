@@ -1,5 +1,4 @@
 import numpy as np
-import sympy
 import ruamel.yaml
 
 from . import utils
@@ -52,7 +51,8 @@ class Solution:
         self.CHeig, self.Seig = utils.get_coefficients(N=self.params.N,
                                                        kappa_tilde=self.kappa_tilde,
                                                        delt=self.params.delt,
-                                                       delx2=self.delx2)
+                                                       delx2=self.delx2,
+                                                       dtype=self.params.precision)
 
         self.restime = 0
         self.tau0 = 0
@@ -61,7 +61,7 @@ class Solution:
         self.stop_reason = 'None'  # why the sim stopped
 
     def __getattr__(self, name: str):
-        if name in ('E','E2','SA','domtime','Ra','L2','PS','delt','it_range'):
+        if name in ('E','E2','SA','domtime','Ra','L2','PS','delt','accepted','rejected','it_range'):
             if hasattr(self, 'timedata') and self.timedata is not None and hasattr(self.timedata, name):
                 return getattr(self.timedata, name)
         raise AttributeError("No such attribute: " + name)
@@ -82,7 +82,7 @@ class Solution:
                 continue
             if type(v) == TimeData:
                 continue
-            if type(v) == sympy.core.numbers.Float:
+            if type(v).__module__.startswith('sympy'):  # e.g. sympy Float of a user function
                 v = float(v)
             attribs[x] = v
         return representer.represent_mapping(tag, attribs)
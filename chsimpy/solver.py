@@ -4,13 +4,18 @@ Model class that contains the actual simulation algorithm
 
 """
 
+import time
+import weakref
+
 import numpy as np
-import scipy.fftpack as scifft
-from scipy.stats import qmc
-import opensimplex
+import scipy.fft
 
 from .solution import Solution, TimeData
+from . import integrators
 from . import mport
+from . import noise
+from . import transforms
+from . import uinit
 from . import utils
 
 
@@ -51,195 +56,453 @@ class Solver:
         self.time_delta_sum = 0.0
         self.time_passed = 0.0
         self._prepared = False
+        self._prepared_steps = 0
+        self._work = None
+        # optional condition stop_when(solver) checked after diagnosed steps (stop reason 'condition')
+        self.stop_when = None
+        # optional checkpoint.Checkpointer, asked after every step
+        self.checkpointer = None
+        # optional filename of a memory-mapped time data file (see TimeData), set before prepare() or restore()
+        self.timedata_spill = None
+        # time.monotonic() when the run stops (wall_max), set by prepare() or restore()
+        self.deadline = None
         self.delt = self.params.delt
+        # float32 halves memory traffic, diagnostics and the clock still accumulate in float64
+        self.dtype = np.dtype(params.precision)
+        # diagnostics policy: metrics are computed every diag_every steps only
+        self.metrics = TimeData.parse_metrics(params.metrics)
+        self.diag_every = max(params.diag_every, 1)
+        # E2 (and mean of U) from the persistent DCT coefficients hat_U (not valid with jitter added to U)
+        self.spectral_energy = params.spectral_energy and params.jitter is None
+        if params.spectral_energy and params.jitter is not None:
+            print('WARNING: spectral_energy is ignored with jitter, E2 is computed from gradients of U.')
+        self._lap = None
+        # in-place DCT of the spectral update (plans and buffers are reused between steps)
+        self.dct = transforms.create(params.fft_backend, params.fft_workers)
+        # time integrator of the DCT coefficients (multipliers are recomputed when delt changes)
+        self.integrator = integrators.create(params.integrator, N=N, kappa_tilde=self.solution.kappa_tilde,
+                                             delx2=self.solution.delx2,
+                                             S=integrators.stabilization(params, self.solution),
+                                             dtype=self.dtype)
+        self._V = None
+        # error-controlled adaptive time stepping (step doubling with PI controller, see _adaptive_step())
+        self.controller = None
+        if params.adaptive_time and self.integrator.multistep:
+            raise ValueError(f"Adaptive time stepping requires a one-step integrator, not '{self.integrator.name}'")
 
         self.create_rand = None
         self.U_init = None
-        # initialize U (concentration)
-        if U_init is not None:
-            if U_init.shape == (params.N, params.N):
-                self.U_init = U_init
-            else:
-                print("U_init has wrong shape, must match parameters.N")
-                exit(1)
-        elif params.generator == 'lcg':  # using linear-congruential generator for portable reproducible random numbers
-            self.U_init = params.XXX + (params.XXX*0.01 * mport.matlab_lcg_sample(N, N, params.seed))
+        skip_rand = None  # advances the stream of create_rand as if U_init was generated (U_init from cache)
+        # position in the stream of create_rand (checkpoints), None for generators without state
+        self.get_rand_state = None
+        self.set_rand_state = None
+        if params.generator == 'lcg':  # using linear-congruential generator for portable reproducible random numbers
+            pass
         elif params.generator == 'sobol':
             # https://blog.scientific-python.org/scipy/qmc-basics/
             # https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.qmc.Sobol.html
+            from scipy.stats import qmc  # imported on demand, scipy.stats is slow to import
             qrng = qmc.Sobol(d=N, seed=params.seed)  # 2D
             self.create_rand = lambda n: qrng.random(n)
+            skip_rand = lambda n: qrng.fast_forward(n)
+            self.get_rand_state = lambda: qrng.num_generated
+            self.set_rand_state = lambda state: qrng.reset().fast_forward(state)
         elif params.generator == 'simplex':
             # https://pypi.org/project/opensimplex/
             # 24 = feature size, 2D Slice of 3D Noise
-            self.create_rand = lambda n: opensimplex.noise2array(np.linspace(0,48,n), np.linspace(0,48,n))
+            self.create_rand = lambda n: uinit.simplex_noise2array(np.linspace(0,48,n), np.linspace(0,48,n))
         else:
             # https://builtin.com/data-science/numpy-random-seed
             rng = np.random.Generator(np.random.PCG64(params.seed))
             self.create_rand = lambda n: rng.random((n, n))
+            skip_rand = lambda n: rng.bit_generator.advance(n * n)  # one 64-bit draw per double
+            self.get_rand_state = lambda: rng.bit_generator.state
+            self.set_rand_state = lambda state: setattr(rng.bit_generator, 'state', state)
+
+        # initialize U (concentration)
+        if U_init is not None:
+            if U_init.shape == (params.N, params.N):
+                self.U_init = U_init
+            else:
+                print("U_init has wrong shape, must match parameters.N")
+                exit(1)
+        elif params.Uinit_cache is not None:
+            self.U_init = uinit.UinitCache(params.Uinit_cache).load(params.generator, params.seed, N, params.XXX)
+            if self.U_init is not None and skip_rand is not None:
+                skip_rand(N)
 
         if self.U_init is None:
-            self.U_init = params.XXX + (params.XXX * 0.01 * (self.create_rand(N) - 0.5))
+            if params.generator == 'lcg':
+                self.U_init = params.XXX + (params.XXX*0.01 * mport.matlab_lcg_sample(N, N, params.seed))
+            else:
+                self.U_init = params.XXX + (params.XXX * 0.01 * (self.create_rand(N) - 0.5))
+            if params.Uinit_cache is not None:
+                uinit.UinitCache(params.Uinit_cache).store(self.U_init, params.generator, params.seed, N, params.XXX)
+
+        # jitter fields are produced ahead of time (continuing the stream of create_rand after U_init)
+        self._noise = None
+        if params.jitter is not None and 0.0 < params.jitter < 0.1:
+            if self.create_rand is None:
+                raise ValueError(f"Jitter requires a random generator (uniform, sobol or simplex), not '{params.generator}'")
+            self._create_noise()
+
+    def _create_noise(self):
+        """(Re)starts the jitter producer at the current position of the stream of create_rand"""
+        if self._noise is not None:
+            self._noise.close()
+        self._noise = noise.NoiseProvider(self.create_rand, self.params.N, self.params.jitter,
+                                          constant=self.params.generator == 'simplex',  # simplex noise is static
+                                          get_state=self.get_rand_state)
+        weakref.finalize(self, self._noise.close)
 
     def prepare(self):
-        U = self.U_init.copy()
-        # shortcuts (only for reading, values do not change)
         N = self.params.N
-        delx = self.solution.delx
-        kappat = self.solution.kappa_tilde
-        Amr = self.solution.Amr
-        RT = self.solution.RT
-        B = self.params.B
-        BRT = self.solution.BRT
-        A0 = self.solution.A0
-        A1 = self.solution.A1
 
-        assert (U.shape == (N, N))
-
-        # initial computations before entering the simulation loop
-        DUx, DUy = np.gradient(U, delx, axis=[0, 1], edge_order=1)
-        Du2 = DUx ** 2 + DUy ** 2
-
-        Uinv = 1 - U
-        E2 = 0.5 * Amr * kappat * self.params.L**2 * np.mean(Du2)
-        # Compute energy etc....
-        E = Amr * self.params.L**2 * np.mean(
-            # Energie
-            np.real(
-                RT * (U * (np.log(U) - B) + Uinv * np.log(Uinv))
-                + (A0 + A1 * (Uinv - U)) * U * Uinv)) + E2
-
-        Um = U - np.mean(U)
-        PS = np.sum(np.abs(Um)) / (N ** 2)
-        L2 = 0  # 1 / (N ** 2) * np.sum(Um ** 2)
-        Ra = np.mean(np.abs(
-            U[int(N / 2) + 1, :] - np.mean(U[int(N / 2) + 1, :])))
+        assert (self.U_init.shape == (N, N))
+        if self.deadline is None:  # a warm start's coarse phase shares the deadline
+            self.deadline = wall_deadline(self.params)
+        # progressive resolution: evolve the nearly uniform early field on a coarse grid first
+        coarse = self._warm_start() if self.params.warm_start > 1 else None
+        if coarse is not None:
+            self.time_delta_sum = coarse.time_delta_sum
+            self.time_passed = coarse.time_passed
+            self.skip_check = coarse.skip_check
+            self.delt = coarse.delt
+
+        self._allocate(self.U_init if coarse is None else resample(coarse.solution.U, N))
+        if coarse is not None:
+            # time and time data continue from the coarse phase
+            self.solution.timedata = coarse.solution.timedata
+            if self.timedata_spill is not None:
+                self.solution.timedata = TimeData.from_data(coarse.solution.timedata.data(), spill=self.timedata_spill)
+            self.solution.computed_steps = coarse.solution.computed_steps
+            self.solution.tau0 = coarse.solution.tau0
+            self.solution.t0 = coarse.solution.t0
+            if coarse.solution.stop_reason == 'condition':
+                self.solution.stop_reason = 'None'
+                self._prepared_steps = coarse.solution.computed_steps
+            else:  # stopped already on the coarse grid (energy, time-limit, wall-limit, ntmax)
+                self.solution.stop_reason = coarse.solution.stop_reason
+                self._prepared_steps = None
+            return
         # contains time data vectors
-        data = TimeData()
-        data.insert(it=0,
-                    delt=self.delt,
-                    E=E,
-                    E2=E2,
-                    SA=0,
-                    domtime=0,
-                    Ra=Ra,
-                    L2=L2,
-                    PS=PS)
-        self.solution.U = U
-        self.solution.timedata = data
+        self.solution.timedata = TimeData(spill=self.timedata_spill)
+        self.solution.computed_steps = 0
+        self._record_diagnostics(self._work.U, domtime=0, L2=0, SA=0)  # L2 = 1 / (N ** 2) * np.sum(Um ** 2)
         # gets values when for-loop breaks early
         self.solution.tau0 = 0.0
         self.solution.t0 = 0.0
         self.solution.stop_reason = 'None'
         self.solution.computed_steps = 1
+        self._prepared_steps = 1  # prepare() did first step
+
+    def _allocate(self, U_start):
+        """Allocates the work arrays and the integrator state, starting from the field U_start"""
+        N = self.params.N
+        # work arrays are allocated once here and reused by every step
+        self._work = WorkBuffers(N, dtype=self.dtype, empty=self.dct.empty)
+        self.integrator.set_delt(self.delt)
+        self.integrator.prepare((N, N), empty=self.dct.empty)
+        U = self._work.U
+        np.copyto(U, U_start)
+        if self.spectral_energy:
+            self._lap = laplacian_weights(N, self.solution.delx2, dtype=self.dtype)
+
+        # initial computations before entering the simulation loop
+        # (hat_U is kept as persistent state between resumes)
+        np.copyto(self._work.hat_U, U)
+        self.dct.forward(self._work.hat_U)
+        self._update_logs(U)
+        if self.params.adaptive_time:
+            self.controller = integrators.StepController(delt=self.delt,
+                                                         tol=self.params.adaptive_tol,
+                                                         order=self.integrator.order,
+                                                         delt_min=self.params.delt_min,
+                                                         delt_max=self.params.delt_max,
+                                                         ladder=self.params.delt_ladder)
+            self.delt = self.controller.delt
+            self.integrator.cache = self.params.delt_ladder > 0  # only a few distinct delt on the ladder
+            self._hat_U0 = np.empty_like(U)
+            self._hat_F0 = np.empty_like(U)
+            self._hat_big = np.empty_like(U)
+            self._energy = self._total_energy(U, self._surface_energy(U))
+        self.solution.U = U
         self._prepared = True
 
+    def state(self):
+        """Returns the complete state of a prepared run as dict of arrays and scalars (see checkpoint.py)
+
+        Continuing from restore(state) gives bit-for-bit the same results as the uninterrupted run.
+        """
+        assert (self._prepared is True)
+        solution = self.solution
+        state = {'U': self._work.U,
+                 'hat_U': self._work.hat_U,
+                 'timedata': solution.timedata.data(),
+                 'computed_steps': solution.computed_steps,
+                 'tau0': solution.tau0,
+                 't0': solution.t0,
+                 'stop_reason': solution.stop_reason,
+                 'delt': self.delt,
+                 'time_delta_sum': self.time_delta_sum,
+                 'time_passed': self.time_passed,
+                 'skip_check': self.skip_check,
+                 'integrator': self.integrator.state(),
+                 'controller': None if self.controller is None else self.controller.state(),
+                 'energy': self._energy if self.controller is not None else None,
+                 'rand_state': None if self._noise is None else self._noise.state()}
+        return state
+
+    def restore(self, state):
+        """Prepares the run from a state of state() instead of prepare() (e.g. to resume a checkpoint)"""
+        self.deadline = wall_deadline(self.params)
+        self.delt = state['delt']
+        self._allocate(state['U'])
+        np.copyto(self._work.hat_U, state['hat_U'])
+        solution = self.solution
+        solution.timedata = TimeData.from_data(state['timedata'], spill=self.timedata_spill)
+        solution.computed_steps = state['computed_steps']
+        solution.tau0 = state['tau0']
+        solution.t0 = state['t0']
+        solution.stop_reason = state['stop_reason']
+        self.delt = state['delt']
+        self.time_delta_sum = state['time_delta_sum']
+        self.time_passed = state['time_passed']
+        self.skip_check = state['skip_check']
+        self.integrator.set_state(state['integrator'])
+        if self.controller is not None:
+            self.controller.set_state(state['controller'])
+            self._energy = state['energy']
+        if self._noise is not None and state['rand_state'] is not None:
+            self.set_rand_state(state['rand_state'])
+            self._create_noise()
+        self._prepared_steps = 0
+
+    def _warm_start(self):
+        """Runs the coarse phase of a progressive-resolution run and returns its solver
+
+        The coarse grid has N / warm_start pixels, U_init is restricted by truncating its DCT coefficients.
+        The phase ends after warm_time seconds (physical time) or when E2 rose to warm_energy times its minimum
+        (phase separation begins), or if the coarse run stops (energy, time-limit, wall-limit).
+        """
+        params = self.params.deepcopy()
+        params.N = self.params.N // self.params.warm_start
+        params.warm_start = 1
+        params.Uinit_cache = None
+        coarse = Solver(params, resample(self.U_init, params.N))
+        warm_time = self.params.warm_time
+        warm_energy = self.params.warm_energy if self.params.warm_time is None else None
+
+        def switch(solver):
+            E2 = solver.solution.timedata.E2
+            if warm_time is not None and solver.time_passed >= warm_time:
+                return True
+            return warm_energy is not None and E2[-1] >= warm_energy * np.nanmin(E2)
+
+        coarse.stop_when = switch
+        coarse.deadline = self.deadline
+        coarse.prepare()
+        coarse.solve_or_resume(self.params.ntmax)
+        return coarse
+
+    def _update_logs(self, U):
+        update_logs(U, self._work)
+
+    def _nonlinear_term(self, U):
+        return nonlinear_term(U, self._work, RT=self.solution.RT, BRT=self.solution.BRT,
+                              A0=self.solution.A0, A1=self.solution.A1)
+
+    def _nonlinear_hat(self, hat_V):
+        """Returns the transformed nonlinear term of the field with coefficients hat_V (multistage integrators)"""
+        if self._V is None:
+            self._V = self.dct.empty(hat_V.shape, dtype=self.dtype)
+        np.copyto(self._V, hat_V)
+        self.dct.inverse(self._V)
+        self._update_logs(self._V)
+        return self.dct.forward(self._nonlinear_term(self._V))
+
+    def _record_diagnostics(self, U, domtime, L2=np.nan, SA=None):
+        """Computes the selected metrics of U and appends them as time data row (NaN = not computed)"""
+        metrics = self.metrics
+        w = self._work
+        solution = self.solution
+        E = E2 = Ra = PS = np.nan
+        # E2 is always needed by the energy stop check, E includes E2
+        if 'E2' in metrics or 'E' in metrics or not self.skip_check:
+            E2 = self._surface_energy(U)
+        if 'E' in metrics:
+            E = self._total_energy(U, E2)
+        if 'PS' in metrics:
+            PS = mean_abs_deviation(U, w, mean=spectral_mean(w.hat_U) if self.spectral_energy else None)
+        if 'Ra' in metrics:
+            Ra = roughness(U, w)
+        if 'L2' not in metrics:
+            L2 = np.nan
+        if 'SA' not in metrics:
+            SA = np.nan
+        elif SA is None:
+            SA = area_below(U, w, self.params.threshold)
+        accepted = rejected = np.nan
+        if self.controller is not None:
+            accepted, rejected = self.controller.accepted, self.controller.rejected
+        solution.timedata.insert(it=solution.computed_steps,
+                                 delt=self.delt,
+                                 E=E,
+                                 E2=E2,
+                                 SA=SA,
+                                 domtime=domtime,
+                                 Ra=Ra,
+                                 L2=L2,
+                                 PS=PS,
+                                 accepted=accepted,
+                                 rejected=rejected)
+
+    def _surface_energy(self, U):
+        """Returns surface energy E2 of U (hat_U are its DCT coefficients)"""
+        solution = self.solution
+        if self.spectral_energy:
+            Du2 = spectral_mean_gradient_sq(self._work.hat_U, self._work, self._lap)
+        else:
+            Du2 = mean_gradient_sq(U, self._work, solution.delx)
+        return 0.5 * solution.Amr * solution.kappa_tilde * self.params.L**2 * Du2
+
+    def _total_energy(self, U, E2):
+        """Returns total energy E of U (uses update_logs() values of U)"""
+        solution = self.solution
+        return solution.Amr * self.params.L**2 * mean_energy_density(U, self._work, RT=solution.RT, B=self.params.B,
+                                                                     A0=solution.A0, A1=solution.A1) + E2
+
+    def _adaptive_step(self, hat_F):
+        """Advances U by one error-controlled step, returns the accepted delt
+
+        The local error is estimated by step doubling (one step of delt vs. two steps of delt/2).
+        Rejected steps (error above tolerance, total energy increased or U left (0, 1)) are rolled back
+        and repeated with a smaller delt proposed by the controller.
+        Returns None (U is rolled back) if the step is not finite even at delt_min.
+        """
+        w = self._work
+        U = w.U
+        hat_U = w.hat_U
+        integrator = self.integrator
+        controller = self.controller
+        np.copyto(self._hat_U0, hat_U)
+        np.copyto(self._hat_F0, hat_F)
+        while True:
+            delt = controller.delt
+            # one step of delt
+            integrator.set_delt(delt)
+            np.copyto(self._hat_big, self._hat_U0)
+            np.copyto(hat_F, self._hat_F0)
+            integrator.step(self._hat_big, hat_F, self._nonlinear_hat)
+            # two steps of delt/2 (the accepted solution)
+            integrator.set_delt(delt / 2)
+            np.copyto(hat_U, self._hat_U0)
+            np.copyto(hat_F, self._hat_F0)
+            integrator.step(hat_U, hat_F, self._nonlinear_hat)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                integrator.step(hat_U, self._nonlinear_hat(hat_U), self._nonlinear_hat)
+            # Richardson estimate of the local error (DCT is orthonormal, so the RMS equals the RMS of U)
+            self._hat_big -= hat_U
+            err = np.sqrt(squared_norm(self._hat_big, w)) / self.params.N / (2**integrator.order - 1)
+            np.copyto(U, hat_U)
+            self.dct.inverse(U)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._update_logs(U)
+                energy = self._total_energy(U, self._surface_energy(U))
+            finite = np.isfinite(energy) and np.isfinite(err)
+            if not finite or err > controller.tol:
+                if controller.reject(err if finite else None):
+                    continue
+                if not finite:
+                    np.copyto(hat_U, self._hat_U0)
+                    np.copyto(U, hat_U)
+                    self.dct.inverse(U)
+                    self._update_logs(U)
+                    return None
+            elif self.params.jitter is None and energy > self._energy + 1e-10 * abs(self._energy):
+                if controller.reject():  # energy must not increase (energy-stability safeguard)
+                    continue
+            controller.accept(err)
+            self._energy = energy
+            return delt
+
     def solve_or_resume(self, nsteps=None):
         """Full simulation run solving Cahn-Hilliard equation returning solution object"""
         assert(self._prepared is True)
         N = self.params.N
-        delx = self.solution.delx
-        kappat = self.solution.kappa_tilde
-        Amr = self.solution.Amr
-        RT = self.solution.RT
-        B = self.params.B
-        BRT = self.solution.BRT
-        A0 = self.solution.A0
-        A1 = self.solution.A1
         if nsteps is None:
             nsteps = max(self.params.ntmax, 0)
         time_limit = None
         if self.params.time_max is not None and self.params.time_max > 0:
             time_limit = self.params.time_max * 60  # to seconds
-        Seig = self.solution.Seig
-        CHeig = self.solution.CHeig
-        threshold = self.params.threshold
-
-        U = self.solution.U
-        hat_U = scifft.dctn(U, norm='ortho')
-        if self.solution.computed_steps == 1:
-            itbegin = 1  # prepare() did first step
-        else:
-            itbegin = 0
+        deadline = self.deadline
+        integrator = self.integrator
+        diag_every = self.diag_every
+
+        w = self._work
+        U = w.U
+        hat_U = w.hat_U
+        if self.solution.U is not U:  # solution field was replaced from outside
+            np.copyto(U, self.solution.U)
+            np.copyto(hat_U, U)
+            self.dct.forward(hat_U)
+            self._update_logs(U)
+            integrator.reset()
+            if self.controller is not None:
+                self._energy = self._total_energy(U, self._surface_energy(U))
+        # steps done by prepare() count towards nsteps of the first call (None: run already stopped in prepare())
+        itbegin = self._prepared_steps
+        self._prepared_steps = 0
+        if itbegin is None:
+            return self.solution
 
         for it in range(itbegin, nsteps):
-            Uinv = 1 - U
-            U1Uinv = U / Uinv
-            U2inv = Uinv - U
-            # compute the shifted nonlinear term
-            # (no convexity splitting!)
-            # EnergieP
-            EnergieEut = np.real(
-                RT * np.log(U1Uinv)
-                - BRT + (A0 + A1 * U2inv) * U2inv
-                - 2 * A1 * U * Uinv)
-
-            if (
-                    self.params.adaptive_time
-                    and self.solution.computed_steps > 500
-                    and np.remainder(self.solution.computed_steps, 2) == 0
-            ):
-                delt_alpha = 500 / (2)**3
-                delt_dyn = np.linalg.norm(self.params.delt_max / np.sqrt(1 + delt_alpha*np.abs(EnergieEut)**2), ord=-1)
-                delt_new = max(self.params.delt, delt_dyn)
-                if delt_new/self.delt > 1.15:
-                    self.delt = 0.75 * self.delt + 0.25 * delt_new
-                else:
-                    self.delt = delt_new
-                CHeig, Seig = utils.get_coefficients(
-                    N=N,
-                    kappa_tilde=self.solution.kappa_tilde,
-                    delt=self.delt,
-                    delx2=self.solution.delx2)
+            if deadline is not None and time.monotonic() > deadline:
+                self.solution.stop_reason = 'wall-limit'
+                break
+            EnergieEut = self._nonlinear_term(U)
+
+            if self.controller is not None:
+                self.delt = self.controller.delt  # proposal, the accepted delt might be smaller
 
             self.time_delta_sum += self.delt
             self.time_passed = self.time_delta_sum / self.params.M_tilde
             if time_limit is not None and self.time_passed > time_limit:
                 self.solution.stop_reason = 'time-limit'
                 break
-            # compute the right hand side in tranform space
-            hat_rhs = hat_U + Seig * scifft.dctn(EnergieEut, norm="ortho")
-
-            # compute the updated psol in tranform space
-            # (see also Ghiass et al (2016),
-            #  the following line should be eq. (12) in Ghiass et al (2016))
-            hat_U = hat_rhs / CHeig
-            # invert the cosine transform
-            U = scifft.idctn(hat_U, norm="ortho")
-
-            if self.params.jitter is not None and 0.0 < self.params.jitter < 0.1:
-                U += self.params.jitter * (2*self.create_rand(N)-1)
-
-            DUx, DUy = np.gradient(U, delx, axis=[0, 1], edge_order=1)
-
-            Du2 = DUx ** 2 + DUy ** 2
-            Uinv = 1 - U
-            E2 = 0.5 * Amr * kappat * self.params.L**2 * np.mean(Du2)
-            E = Amr * self.params.L**2 * np.mean(
-                  np.real(
-                    RT * (U * (np.log(U) - B) + Uinv * np.log(Uinv))
-                    + (A0 + A1 * (Uinv - U)) * U * Uinv)) + E2
-
-            Um = U - np.mean(U)
-            PS = np.sum(np.abs(Um)) / (N ** 2)
-            L2 = np.linalg.norm(EnergieEut)/N**2 #1 / (N ** 2) * np.sum(Um ** 2)
-            Ra = np.mean(np.abs(
-                U[int(N / 2) + 1, :] - np.mean(U[int(N / 2) + 1, :])))
-            SA = np.sum(U < threshold) / (N ** 2)  # determining relative concentration of A in U by threshold
-
-            domtime = self.time_passed ** (1 / 3)
-            self.solution.timedata.insert(it=self.solution.computed_steps,
-                                          delt=self.delt,
-                                          E=E,
-                                          E2=E2,
-                                          SA=SA,
-                                          domtime=domtime,
-                                          Ra=Ra,
-                                          L2=L2,
-                                          PS=PS)
+            diagnose = self.solution.computed_steps % diag_every == 0
+            L2 = np.nan
+            if diagnose and 'L2' in self.metrics:
+                # norm of EnergieEut, 1 / (N ** 2) * np.sum(Um ** 2)
+                L2 = np.sqrt(squared_norm(EnergieEut, w)) / N**2
+            # compute the updated psol in tranform space (transform of EnergieEut is done in place)
+            # (default: semi-implicit eq. (12) in Ghiass et al (2016), see integrators.py)
+            if self.controller is None:
+                integrator.step(hat_U, self.dct.forward(EnergieEut), self._nonlinear_hat)
+                # invert the cosine transform
+                np.copyto(U, hat_U)
+                self.dct.inverse(U)
+            else:
+                self.time_delta_sum -= self.delt
+                delt = self._adaptive_step(self.dct.forward(EnergieEut))
+                if delt is None:  # diverges even at delt_min, U is the last finite field
+                    self.time_passed = self.time_delta_sum / self.params.M_tilde
+                    self.solution.stop_reason = 'non-finite'
+                    break
+                self.delt = delt
+                self.time_delta_sum += self.delt
+                self.time_passed = self.time_delta_sum / self.params.M_tilde
+
+            if self._noise is not None:
+                U += self._noise.next()
+
+            self._update_logs(U)
+            if diagnose:
+                self._record_diagnostics(U, domtime=self.time_passed ** (1 / 3), L2=L2)
             self.solution.computed_steps += 1
 
-            if not self.skip_check and self.solution.timedata.energy_falls(self.solution.computed_steps-1):
+            # energy check on the (decimated) time data rows
+            if diagnose and not self.skip_check and self.solution.timedata.energy_falls():
                 self.solution.tau0 = self.solution.computed_steps
                 self.solution.t0 = self.time_passed
                 if not self.params.full_sim:
@@ -248,5 +511,169 @@ class Solver:
                 else:
                     self.skip_check = True
 
+            if diagnose and self.stop_when is not None and self.stop_when(self):
+                self.solution.stop_reason = 'condition'
+                break
+
+            if self.checkpointer is not None and self.checkpointer.due(self.solution.computed_steps):
+                self.checkpointer.write(self)
+
         self.solution.U = U
         return self.solution
+
+
+class WorkBuffers:
+    def __init__(self, N, dtype=np.float64, empty=np.empty, members=None):
+        """Preallocated NxN work arrays of the solver, so steady-state stepping does not allocate
+
+        empty allocates the arrays which are transformed in place (e.g. aligned for FFTW).
+        With members the arrays are stacks of shape (members, N, N).
+        """
+        shape = (N, N) if members is None else (members, N, N)
+        self.U = empty(shape, dtype=dtype)
+        self.hat_U = empty(shape, dtype=dtype)
+        self.Uinv = np.empty(shape, dtype=dtype)  # 1 - U
+        self.logU = np.empty(shape, dtype=dtype)
+        self.logUinv = np.empty(shape, dtype=dtype)
+        self.EnergieEut = empty(shape, dtype=dtype)  # nonlinear term, transformed in place
+        self.tmp = np.empty(shape, dtype=dtype)
+        self.tmp2 = np.empty(shape, dtype=dtype)
+        self.mask = np.empty(shape, dtype=bool)
+        self.row = np.empty(shape[:-1], dtype=dtype)
+
+
+# The following functions compute on single fields (N, N) or stacks (members, N, N) in place.
+# Parameters (RT, A0, ...) are scalars or arrays broadcastable to (members, 1, 1).
+# Reductions are over the last two axes and accumulate in float64.
+
+
+def wall_deadline(params):
+    """Returns the time.monotonic() deadline of a run starting now (wall_max minutes), None if unlimited"""
+    if params.wall_max is None or params.wall_max <= 0:
+        return None
+    return time.monotonic() + params.wall_max * 60
+
+
+def resample(U, N):
+    """Returns U resampled to NxN by truncating or zero-padding its orthonormal DCT coefficients (mean is kept)"""
+    n = U.shape[-1]
+    m = min(n, N)
+    hat = scipy.fft.dctn(U, axes=(-2, -1), norm='ortho')
+    hat_N = np.zeros(U.shape[:-2] + (N, N))
+    hat_N[..., :m, :m] = hat[..., :m, :m] * (N / n)
+    return scipy.fft.idctn(hat_N, axes=(-2, -1), norm='ortho')
+
+
+def update_logs(U, w):
+    """Computes 1-U, log(U) and log(1-U) in place (shared by nonlinear term and energy)"""
+    np.subtract(1, U, out=w.Uinv)
+    np.log(U, out=w.logU)
+    np.log(w.Uinv, out=w.logUinv)
+
+
+def nonlinear_term(U, w, RT, BRT, A0, A1):
+    """Computes the shifted nonlinear term (no convexity splitting!) in place and returns it
+
+    EnergieEut = RT*log(U/(1-U)) - BRT + (A0 + A1*(1-2U))*(1-2U) - 2*A1*U*(1-U)
+    """
+    EnergieEut = w.EnergieEut
+    U2inv = w.tmp2
+    np.subtract(w.logU, w.logUinv, out=EnergieEut)  # log(U/(1-U))
+    EnergieEut *= RT
+    EnergieEut -= BRT
+    np.subtract(w.Uinv, U, out=U2inv)
+    np.multiply(A1, U2inv, out=w.tmp)
+    w.tmp += A0
+    w.tmp *= U2inv
+    EnergieEut += w.tmp
+    np.multiply(2 * A1, U, out=w.tmp)
+    w.tmp *= w.Uinv
+    EnergieEut -= w.tmp
+    return EnergieEut
+
+
+def mean_gradient_sq(U, w, delx):
+    """Returns mean of the squared gradient of U (for surface energy E2)"""
+    DUx = _gradient(U, delx, axis=-2, out=w.tmp)
+    DUy = _gradient(U, delx, axis=-1, out=w.tmp2)
+    np.square(DUx, out=DUx)
+    np.square(DUy, out=DUy)
+    DUx += DUy  # Du2
+    return np.mean(DUx, axis=(-2, -1), dtype=np.float64)
+
+
+def mean_energy_density(U, w, RT, B, A0, A1):
+    """Returns mean Flory-Huggins-Gibbs energy density of U (uses update_logs() values of U)"""
+    # Energie: RT * (U * (log(U) - B) + Uinv * log(Uinv)) + (A0 + A1 * (Uinv - U)) * U * Uinv
+    Energie = w.tmp
+    np.subtract(w.logU, B, out=Energie)
+    Energie *= U
+    np.multiply(w.Uinv, w.logUinv, out=w.tmp2)
+    Energie += w.tmp2
+    Energie *= RT
+    np.subtract(w.Uinv, U, out=w.tmp2)
+    w.tmp2 *= A1
+    w.tmp2 += A0
+    w.tmp2 *= U
+    w.tmp2 *= w.Uinv
+    Energie += w.tmp2
+    return np.mean(Energie, axis=(-2, -1), dtype=np.float64)
+
+
+def laplacian_weights(N, delx2, dtype=np.float64):
+    """Returns -eigenvalues/delx2 of the discrete Laplacian of the DCT (weights of squared DCT coefficients)"""
+    return (-utils.get_eigenvalues(N) / delx2).astype(dtype)
+
+
+def spectral_mean_gradient_sq(hat_U, w, lap):
+    """Returns mean squared gradient of U from its orthonormal DCT coefficients (Parseval)
+
+    Uses the Laplacian of the spectral update: mean(|grad U|^2) = -sum(U * lap(U)) / N^2.
+    This discretization differs from np.gradient (central differences) by a roughly constant factor.
+    """
+    sq = np.square(hat_U, out=w.tmp)
+    sq *= lap
+    return np.sum(sq, axis=(-2, -1), dtype=np.float64) / (hat_U.shape[-1] ** 2)
+
+
+def spectral_mean(hat_U):
+    """Returns mean of U from its orthonormal DCT coefficients"""
+    return np.asarray(hat_U[..., 0:1, 0:1], dtype=np.float64) / hat_U.shape[-1]
+
+
+def mean_abs_deviation(U, w, mean=None):
+    if mean is None:
+        mean = np.mean(U, axis=(-2, -1), dtype=np.float64, keepdims=True)
+    Um = np.subtract(U, mean, out=w.tmp)
+    np.abs(Um, out=Um)
+    return np.sum(Um, axis=(-2, -1), dtype=np.float64) / (U.shape[-1] ** 2)
+
+
+def roughness(U, w):
+    N = U.shape[-1]
+    Urow = U[..., int(N / 2) + 1, :]
+    row = np.subtract(Urow, np.mean(Urow, axis=-1, dtype=np.float64, keepdims=True), out=w.row)
+    np.abs(row, out=row)
+    return np.mean(row, axis=-1, dtype=np.float64)
+
+
+def area_below(U, w, threshold):
+    """Returns relative area where U < threshold (relative concentration of A in U)"""
+    return np.count_nonzero(np.less(U, threshold, out=w.mask), axis=(-2, -1)) / (U.shape[-1] ** 2)
+
+
+def squared_norm(X, w):
+    return np.sum(np.square(X, out=w.tmp), axis=(-2, -1), dtype=np.float64)
+
+
+def _gradient(U, delx, axis, out):
+    """np.gradient(U, delx, axis=axis, edge_order=1) written into out"""
+    Ut = np.moveaxis(U, axis, 0)
+    G = np.moveaxis(out, axis, 0)
+    np.subtract(Ut[2:], Ut[:-2], out=G[1:-1])
+    G[1:-1] /= 2. * delx
+    np.subtract(Ut[1], Ut[0], out=G[0])
+    G[0] /= delx
+    np.subtract(Ut[-1], Ut[-2], out=G[-1])
+    G[-1] /= delx
+    return out
@@ -0,0 +1,138 @@
+"""
+Thermodynamics of the Gibbs free energy G(c) (Flory-Huggins entropy, Redlich-Kister interaction) with NumPy:
+miscibility gap (common tangent), spinodal and the distance to the common tangent
+
+Functions are vectorized over arrays of T, A0, A1 (broadcast), the scalar versions of utils are memoized.
+sympy is only imported by the reference solutions at the end of this module.
+"""
+
+import numpy as np
+
+
+def gibbs(c, RT, B, A0, A1):
+    """G(c) = RT * (c * (ln(c) - B) + (1-c) * ln(1-c)) + (A0 + A1 * (1-2c)) * c * (1-c)"""
+    return RT * (c * (np.log(c) - B) + (1 - c) * np.log(1 - c)) + (A0 + A1 * (1 - 2 * c)) * c * (1 - c)
+
+
+def gibbs_first_derivative(c, RT, B, A0, A1):
+    """G'(c)"""
+    return RT * (np.log(c) - np.log(1 - c) - B) + (A0 + A1) * (1 - 2 * c) - 4 * A1 * c + 6 * A1 * c ** 2
+
+
+def gibbs_second_derivative(c, RT, A0, A1):
+    """G''(c) of the Redlich-Kister Gibbs energy, derivative of EnergieEut w.r.t. U"""
+    return RT / (c * (1 - c)) - 2 * A0 - 6 * A1 * (1 - 2 * c)
+
+
+def common_tangent(R, T, B, A0, A1, xlower=0.7, xupper=0.9999, tol=1e-13, maxiter=100):
+    """Returns (c_A, c_B) of the miscibility gap, the points of the common tangent of G
+
+    Damped Newton iteration on G'(x1) = G'(x2) and G'(x1) * (x2 - x1) = G(x2) - G(x1), starting at (xlower, xupper).
+    Entries which do not converge are NaN.
+    """
+    RT, B, A0, A1 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (R * np.asarray(T), B, A0, A1)))
+    x1 = np.full(RT.shape, xlower, dtype=np.float64)
+    x2 = np.full(RT.shape, xupper, dtype=np.float64)
+    converged = np.zeros(RT.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(maxiter):
+            d1 = gibbs_first_derivative(x1, RT, B, A0, A1)
+            d2 = gibbs_first_derivative(x2, RT, B, A0, A1)
+            dd1 = gibbs_second_derivative(x1, RT, A0, A1)
+            dd2 = gibbs_second_derivative(x2, RT, A0, A1)
+            F1 = d1 - d2
+            F2 = gibbs(x2, RT, B, A0, A1) - gibbs(x1, RT, B, A0, A1) - d1 * (x2 - x1)
+            # Jacobian [[G''(x1), -G''(x2)], [-G''(x1) * (x2 - x1), G'(x2) - G'(x1)]]
+            J21 = -dd1 * (x2 - x1)
+            J22 = d2 - d1
+            det = dd1 * J22 + dd2 * J21
+            step1 = (F1 * J22 + dd2 * F2) / det
+            step2 = (dd1 * F2 - J21 * F1) / det
+            # damping keeps 0 < x1 < x2 < 1
+            lam = np.ones_like(x1)
+            for _ in range(60):
+                n1, n2 = x1 - lam * step1, x2 - lam * step2
+                invalid = ~((0 < n1) & (n1 < n2) & (n2 < 1))
+                if not np.any(invalid):
+                    break
+                lam = np.where(invalid, lam / 2, lam)
+            x1 = np.where(converged, x1, n1)
+            x2 = np.where(converged, x2, n2)
+            converged |= (np.abs(lam * step1) <= tol * x1) & (np.abs(lam * step2) <= tol * x2)
+            if np.all(converged):
+                break
+    x1 = np.where(converged, x1, np.nan)
+    x2 = np.where(converged, x2, np.nan)
+    return x1[()], x2[()]
+
+
+def distance_common_tangent(R, T, B, A0, A1, at, gap=None):
+    """Returns G(at) minus the common tangent at at (base of kappa_tilde)
+
+    gap is the (c_A, c_B) of common_tangent() if it is already known.
+    """
+    RT = R * np.asarray(T)
+    ca, cb = common_tangent(R, T, B, A0, A1) if gap is None else gap
+    Ga = gibbs(ca, RT, B, A0, A1)
+    m = (gibbs(cb, RT, B, A0, A1) - Ga) / (cb - ca)
+    return gibbs(np.asarray(at, dtype=np.float64), RT, B, A0, A1) - m * (at - ca) - Ga
+
+
+def spinodal(R, T, A0, A1):
+    """Returns (s_A, s_B), the roots of G'' in (0, 1) (NaN if there are none, above the critical temperature)
+
+    Roots of the cubic c * (1-c) * G''(c) = 0 in closed form (trigonometric solution) polished by Newton steps.
+    """
+    RT, A0, A1 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (R * np.asarray(T), A0, A1)))
+    # -c * (1-c) * G''(c) = a c^3 + b c^2 + c1 c + d
+    a = 12 * A1
+    b = -2 * A0 - 18 * A1
+    c1 = 2 * A0 + 6 * A1
+    d = -RT
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # depressed cubic t^3 + p t + q with c = t - b / (3a)
+        p = (3 * a * c1 - b ** 2) / (3 * a ** 2)
+        q = (2 * b ** 3 - 9 * a * b * c1 + 27 * a ** 2 * d) / (27 * a ** 3)
+        # three real roots if p < 0 and 4p^3 + 27q^2 <= 0, else NaN
+        r = 2 * np.sqrt(-p / 3)
+        phi = np.arccos(np.clip(3 * q / (p * r), -1, 1))
+        k = np.arange(3).reshape((3,) + (1,) * p.ndim)
+        roots = r * np.cos((phi - 2 * np.pi * k) / 3) - b / (3 * a)
+        roots = np.where(4 * p ** 3 + 27 * q ** 2 <= 0, roots, np.nan)
+        # A1 = 0: quadratic b c^2 + c1 c + d
+        sq = np.sqrt(c1 ** 2 - 4 * b * d)
+        quadratic = np.stack([(-c1 - sq) / (2 * b), (-c1 + sq) / (2 * b), np.full(b.shape, np.nan)])
+        roots = np.where(a == 0, quadratic, roots)
+        for _ in range(3):
+            f = ((a * roots + b) * roots + c1) * roots + d
+            df = (3 * a * roots + 2 * b) * roots + c1
+            roots = roots - np.where(df != 0, f / df, 0)
+    # the roots in (0, 1) come in pairs, as the cubic is -RT < 0 at c = 0 and c = 1
+    roots = np.where((0 < roots) & (roots < 1), roots, np.nan)
+    roots = np.sort(roots, axis=0)  # NaN last
+    return roots[0][()], roots[1][()]
+
+
+#
+# reference solutions with sympy (slow, imported on demand), e.g. for tests
+#
+
+def sympy_common_tangent(R, T, B, A0, A1, xlower=0.7, xupper=0.9999, prec=30):
+    import sympy as sym
+    x1 = sym.Symbol('x1', real=True)
+    x2 = sym.Symbol('x2', real=True)
+    y1, y2 = (R * T * (c * (sym.log(c) - B) + (1 - c) * sym.log(1 - c)) + (A0 + A1 * (1 - 2 * c)) * c * (1 - c)
+              for c in (x1, x2))
+    dy1 = sym.diff(y1, x1, 1)
+    dy2 = sym.diff(y2, x2, 1)
+    # f'(x1) == f'(x2), x1!=x2
+    # f'(x1) == (y2-y1)/(x2-x1)
+    # ... https://mathematica.stackexchange.com/questions/25892/common-tangent-to-a-curve
+    return sym.nsolve((sym.Eq(dy1, dy2), sym.Eq(dy1, (y2 - y1) / (x2 - x1))), (x1, x2), (xlower, xupper), prec=prec)
+
+
+def sympy_spinodal(R, T, A0, A1):
+    import sympy as sym
+    c = sym.Symbol('x', real=True, positive=True)
+    EPP = (-2*A0*c**2+2*A0*c+12*A1*c**3 - 18*A1*c**2+6*A1*c-R*T)/(c**2-c)
+    return list(sym.solveset(EPP, c, domain=sym.Interval(0, 1)))
@@ -1,56 +1,140 @@
+import os
+
 import numpy as np
 
 
 class TimeData:
-    def __init__(self):
-        self._data = np.empty(shape=(0, 9))
+    METRICS = ('E', 'E2', 'SA', 'Ra', 'L2', 'PS')  # observables a solver can compute
+    COLUMNS = ('it', 'E', 'E2', 'SA', 'domtime', 'Ra', 'L2', 'PS', 'delt', 'accepted', 'rejected')
+    CAPACITY = 1024  # rows allocated first, the capacity doubles whenever it is exhausted
+
+    def __init__(self, spill=None):
+        """Time data rows of a run in a growable columnar buffer (one contiguous array per column)
+
+        With spill (a filename), the buffer is the memory-mapped .npy file spill: the history of long runs is
+        paged out to disk instead of being held in RAM, and the rows written so far survive a crash (see load_spill()).
+        """
+        self.spill = spill
+        self._size = 0
+        self._columns = None
+        self._grow(self.CAPACITY)
 
-    def insert(self, it, delt, E, E2, SA, domtime, Ra, L2, PS):
-        self._data = np.append(self._data, [[it, E, E2, SA, domtime, Ra, L2, PS, delt]], axis=0)
-        assert(not np.any(np.isnan(self._data[-1])))
+    def _grow(self, capacity):
+        """Reallocates the buffer with capacity rows and copies the rows"""
+        shape = (len(self.COLUMNS), capacity)
+        if self.spill is None:
+            columns = np.empty(shape)
+        else:
+            # the grown file replaces the spill file when it is complete
+            tmpname = self.spill + '.tmp'
+            columns = np.lib.format.open_memmap(tmpname, mode='w+', shape=shape)
+            columns[0, self._size:] = np.nan  # rows without iteration number are unused
+            columns = columns.view(np.ndarray)  # plain views of the mapping are cheaper than memmap slices
+        if self._columns is not None:
+            columns[:, :self._size] = self._columns[:, :self._size]
+        if self.spill is not None:
+            self._columns = None  # unmaps the previous file
+            os.replace(tmpname, self.spill)
+        self._columns = columns
+
+    def insert(self, it, delt, E, E2, SA, domtime, Ra, L2, PS, accepted=np.nan, rejected=np.nan):
+        # accepted, rejected = number of steps of the adaptive time stepping so far (NaN with fixed delt)
+        # metrics which are not computed are NaN
+        assert (it == it and domtime == domtime and delt == delt)  # not NaN
+        n = self._size
+        if n == self._columns.shape[1]:
+            self._grow(2 * n)
+        self._columns[1:, n] = (E, E2, SA, domtime, Ra, L2, PS, delt, accepted, rejected)
+        self._columns[0, n] = it  # last, marks the row as complete in a spill file
+        self._size = n + 1
+
+    def extend(self, data):
+        """Appends the rows of data (see data())"""
+        data = np.asarray(data, dtype=np.float64).reshape(-1, len(self.COLUMNS))
+        n = self._size + data.shape[0]
+        if n > self._columns.shape[1]:
+            self._grow(max(2 * self._columns.shape[1], n))
+        self._columns[:, self._size:n] = data.T
+        self._size = n
 
     def data(self):
-        return self._data
+        """Returns the rows as (rows, columns) view of the buffer, columns see COLUMNS"""
+        return self._columns[:, :self._size].T
+
+    @classmethod
+    def from_data(cls, data, spill=None):
+        """Returns time data with the rows of data (see data())"""
+        timedata = cls(spill)
+        timedata.extend(data)
+        return timedata
+
+    @classmethod
+    def load_spill(cls, fname):
+        """Returns the time data of a spill file (e.g. of a crashed run), all rows are kept in RAM"""
+        columns = np.load(fname, mmap_mode='r')
+        size = np.count_nonzero(~np.isnan(columns[0]))  # rows are written in order
+        return cls.from_data(columns[:, :size].T)
 
     @property
     def it_range(self):
-        return self._data[:, 0]
+        return self._columns[0, :self._size]
 
     @property
     def E(self):
-        return self._data[:, 1]
+        return self._columns[1, :self._size]
 
     @property
     def E2(self):
-        return self._data[:, 2]
+        return self._columns[2, :self._size]
 
     @property
     def SA(self):
-        return self._data[:, 3]
+        return self._columns[3, :self._size]
 
     @property
     def domtime(self):
-        return self._data[:, 4]
+        return self._columns[4, :self._size]
 
     @property
     def Ra(self):
-        return self._data[:, 5]
+        return self._columns[5, :self._size]
 
     @property
     def L2(self):
-        return self._data[:, 6]
+        return self._columns[6, :self._size]
 
     @property
     def PS(self):
-        return self._data[:, 7]
+        return self._columns[7, :self._size]
 
     @property
     def delt(self):
-        return self._data[:, 8]
+        return self._columns[8, :self._size]
+
+    @property
+    def accepted(self):
+        return self._columns[9, :self._size]
+
+    @property
+    def rejected(self):
+        return self._columns[10, :self._size]
+
+    @staticmethod
+    def parse_metrics(metrics):
+        """Returns set of metric names from a string like 'E2,SA' (None or 'all' = all metrics)"""
+        if metrics is None or metrics.strip().lower() == 'all':
+            return frozenset(TimeData.METRICS)
+        names = frozenset(m for m in metrics.replace(' ', '').split(',') if m != '')
+        unknown = names.difference(TimeData.METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics {sorted(unknown)}, must be in {TimeData.METRICS}")
+        return names
 
     def energy_falls(self, it=None):
         """Checks if E2 curve really falls and returns True then.
 
+        it is the row index of the time data (default: last row), rows might be decimated.
+
         Always False if 'it<100 or sum(E2[-50:-25]) < sum(E2[-25:])'.
         Else if 'E2[it] < E2[it-1] && E2[it] > E2[0]' then it returns True.
         """
@@ -60,4 +144,8 @@ class TimeData:
         # s2 = np.sum(self.E2[-25:])
         # if s1 < s2:
         #     return False
+        if it is None:
+            it = self._size - 1
+        if it < 1:
+            return False
         return self.E2[it-1] > self.E2[it] > self.E2[0]
\ No newline at end of file
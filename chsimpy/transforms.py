@@ -0,0 +1,118 @@
+"""
+Backends for the orthonormal 2D discrete cosine transform (DCT-II) of the spectral update
+
+All backends transform the last two axes in place, so the solver can keep its work buffers.
+Stacks of fields (members, N, N) are transformed member-wise.
+"""
+
+import numpy as np
+import scipy.fft
+
+from . import utils
+
+
+BACKENDS = ('scipy', 'fftpack', 'pyfftw')
+AXES = (-2, -1)
+
+
+class ScipyDCT:
+    def __init__(self, workers=1):
+        """DCT by scipy.fft (pocketfft caches its plans), multithreaded by workers (-1 = all cores)"""
+        self.workers = workers
+
+    def empty(self, shape, dtype=np.float64):
+        return np.empty(shape, dtype=dtype)
+
+    def forward(self, x):
+        return _copy_back(x, scipy.fft.dctn(x, axes=AXES, norm='ortho', overwrite_x=True, workers=self.workers))
+
+    def inverse(self, x):
+        return _copy_back(x, scipy.fft.idctn(x, axes=AXES, norm='ortho', overwrite_x=True, workers=self.workers))
+
+
+class FftpackDCT:
+    def __init__(self, workers=1):
+        """Legacy single-threaded DCT by scipy.fftpack (workers are ignored)"""
+        import scipy.fftpack  # imported on demand, only this backend uses it
+        self.workers = 1
+
+    def empty(self, shape, dtype=np.float64):
+        return np.empty(shape, dtype=dtype)
+
+    def forward(self, x):
+        return _copy_back(x, scipy.fftpack.dctn(x, axes=AXES, norm='ortho', overwrite_x=True))
+
+    def inverse(self, x):
+        return _copy_back(x, scipy.fftpack.idctn(x, axes=AXES, norm='ortho', overwrite_x=True))
+
+
+class FFTWDCT:
+    def __init__(self, workers=1):
+        """DCT by planned in-place FFTW transforms (requires pyfftw)
+
+        Plans are created once per array and direction and reused in every step.
+        FFTW computes unnormalized REDFT10/REDFT01, so the orthonormal scaling is applied in place.
+        """
+        import pyfftw
+        self._pyfftw = pyfftw
+        self.workers = utils.get_number_physical_cores() if workers is None or workers < 1 else workers
+        self._plans = {}
+        self._scales = {}
+
+    def empty(self, shape, dtype=np.float64):
+        return self._pyfftw.empty_aligned(shape, dtype=dtype)
+
+    def forward(self, x):
+        self._plan(x, 'FFTW_REDFT10').execute()
+        x *= self._scale(x.shape[-2:], x.dtype, inverse=False)
+        return x
+
+    def inverse(self, x):
+        x *= self._scale(x.shape[-2:], x.dtype, inverse=True)
+        self._plan(x, 'FFTW_REDFT01').execute()
+        return x
+
+    def _plan(self, x, direction):
+        key = (x.__array_interface__['data'][0], x.shape, x.dtype.str, direction)
+        plan = self._plans.get(key)
+        if plan is None:
+            saved = x.copy()  # planning may overwrite the array
+            plan = self._pyfftw.FFTW(x, x, axes=AXES, direction=[direction] * len(AXES),
+                                     flags=['FFTW_MEASURE', 'FFTW_DESTROY_INPUT'], threads=self.workers)
+            np.copyto(x, saved)
+            self._plans[key] = plan
+        return plan
+
+    def _scale(self, shape, dtype, inverse):
+        key = (shape, np.dtype(dtype).str, inverse)
+        scale = self._scales.get(key)
+        if scale is None:
+            scale = np.ones(shape, dtype=dtype)
+            for axis, n in enumerate(shape):
+                # forward: y = f * REDFT10(x), inverse: x = REDFT01(g * y)
+                fac = np.full(n, 1 / np.sqrt(2 * n))
+                fac[0] = 1 / np.sqrt(n) if inverse else 1 / (2 * np.sqrt(n))
+                scale *= fac.reshape([-1 if a == axis else 1 for a in range(len(shape))]).astype(dtype)
+            self._scales[key] = scale
+        return scale
+
+
+def create(backend='scipy', workers=1):
+    """Returns DCT backend by name ('scipy', 'fftpack' or 'pyfftw' if installed)"""
+    if backend is None or backend == 'scipy':
+        return ScipyDCT(workers)
+    elif backend == 'fftpack':
+        return FftpackDCT(workers)
+    elif backend == 'pyfftw':
+        if not utils.module_exists('pyfftw'):
+            raise ImportError("fft backend 'pyfftw' requires the pyfftw package (pip install pyfftw)")
+        return FFTWDCT(workers)
+    else:
+        raise ValueError(f"Unknown fft backend '{backend}', must be one of {BACKENDS}")
+
+
+def _copy_back(x, y):
+    # scipy transforms in place where possible, otherwise the result is copied into x
+    if not np.may_share_memory(x, y):
+        np.copyto(x, y)
+    return x
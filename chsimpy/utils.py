@@ -4,14 +4,17 @@ import ruamel.yaml
 import time
 from datetime import datetime
 import platform
-import sympy as sym
-import pandas as pd
 import sys
 import os
 import psutil
-import matplotlib.pyplot as plt
 import importlib.util
+import collections
+import functools
+import bz2
+import gzip
+from concurrent.futures import ThreadPoolExecutor
 
+from . import thermo
 from .version import __version__
 
 
@@ -32,21 +35,81 @@ def A1(T):
 
 
 def eigenvalues(N):
-    return (2 * np.cos(np.pi * (np.arange(0, N - 1 + 1)) / (N - 1)) - 2).reshape(N, 1) @ np.ones((1, N)) \
-        + np.ones((N, 1)) @ ((2 * np.cos(np.pi * (np.arange(0, N - 1 + 1)) / (N - 1))) - 2).reshape(1, N)
-
-
-def get_coefficients(N, kappa_tilde, delt, delx2):
+    # sum of the 1D eigenvalues of both axes (outer sum, no NxN matrix products)
+    eig = 2 * np.cos(np.pi * np.arange(N) / (N - 1)) - 2
+    return np.add.outer(eig, eig)
+
+
+class ArrayCache:
+    def __init__(self, max_bytes):
+        """Least-recently-used cache of read-only arrays (or tuples of arrays), bounded by their total size"""
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def get(self, key, create):
+        """Returns the cached value of key, create() computes it on a miss
+
+        Arrays of the value are made read-only, as they are shared by all users of the process.
+        Values larger than max_bytes are returned but not cached.
+        """
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = create()
+        arrays = value if isinstance(value, tuple) else (value,)
+        nbytes = sum(a.nbytes for a in arrays)
+        if nbytes > self.max_bytes:
+            return value
+        for a in arrays:
+            a.setflags(write=False)
+        self._items[key] = value
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self.nbytes -= sum(a.nbytes for a in (old if isinstance(old, tuple) else (old,)))
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+
+# process-wide cache of spectral coefficients (shared by all runs of a process, e.g. experiment workers)
+coefficient_cache = ArrayCache(max_bytes=512 * 2**20)
+
+
+def get_eigenvalues(N):
+    """Returns eigenvalues(N), cached process-wide (read-only array)"""
+    return coefficient_cache.get(('eigenvalues', N), lambda: eigenvalues(N))
+
+
+def get_coefficients(N, kappa_tilde, delt, delx2, dtype=np.float64, cache=True):
+    """Returns (CHeig, Seig) of the semi-implicit update, cached for scalar parameters (read-only arrays)"""
+    dtype = np.dtype(dtype)
+    if not cache or np.ndim(kappa_tilde) != 0:  # e.g. stacked ensemble members
+        return _get_coefficients(N, kappa_tilde, delt, delx2, dtype)
+    key = ('coefficients', N, float(kappa_tilde), float(delt), float(delx2), dtype.str)
+    return coefficient_cache.get(key, lambda: _get_coefficients(N, kappa_tilde, delt, delx2, dtype))
+
+
+def _get_coefficients(N, kappa_tilde, delt, delx2, dtype):
     # time marching update parameters
     lam1 = delt / delx2
     lam2 = kappa_tilde * lam1 / delx2
     # matrix of eigenvalues of the DCT
-    leig = eigenvalues(N)
+    leig = get_eigenvalues(N)
     # scaled eigenvalues of stabilized CH update matrix
     CHeig = np.ones((N, N)) + lam2 * leig * leig
     # scaled eigenvalues of the laplacian
     Seig = lam1 * leig
-    return CHeig, Seig
+    # computed in float64, only stored in (lower) simulation precision
+    return CHeig.astype(dtype, copy=False), Seig.astype(dtype, copy=False)
 
 
 def yaml_repr_ndarray(representer, data):
@@ -76,20 +139,84 @@ def yaml_import(fname):
     return instance
 
 
-def csv_export_matrix(V, fname):
-    if fname.endswith('bz2'):
-        pd.DataFrame(V).to_csv(fname, index=False, header=None, sep=',', compression='bz2')
-    else:
+# compression of csv files by extension: bz2 (smallest) or gz (zlib, several times faster)
+CSV_CODECS = {
+    'bz2': lambda data: bz2.compress(data, 9),
+    'gz': lambda data: gzip.compress(data, compresslevel=1, mtime=0),
+}
+
+
+def csv_export_matrix(V, fname, workers=2, block_rows=256):
+    """Writes V as csv to fname, compressed if the extension is a codec of CSV_CODECS
+
+    Compressed files are written as concatenated, independently compressed streams of block_rows rows,
+    formatted and compressed by workers threads (-1 = physical cores). Standard readers decode them as one file.
+    The default is a few threads, as several processes might export at once (e.g. experiment runs).
+    """
+    codec = CSV_CODECS.get(fname.rsplit('.', 1)[-1])
+    if codec is None:
         np.savetxt(fname, V, delimiter=',', fmt='%s')
+        return
+    V = np.asarray(V)
+    if V.ndim == 1:
+        V = V[:, np.newaxis]
+
+    def compress_rows(first):
+        # repr is the shortest exact text of a float (as pandas.to_csv writes it)
+        rows = V[first:first + block_rows].tolist()
+        return codec(''.join(','.join(map(repr, row)) + '\n' for row in rows).encode())
+
+    if workers < 1:
+        workers = get_number_physical_cores()
+    blocks = range(0, V.shape[0], block_rows)
+    with open(fname, 'wb') as f:
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(blocks)), 1)) as pool:
+            for stream in pool.map(compress_rows, blocks):  # in order
+                f.write(stream)
 
 
 def csv_import_matrix(fname):
-    if fname.endswith('bz2'):
-        return pd.read_csv(fname, sep=',', header=None, compression='bz2').values
+    if fname.endswith(('.npy', '.npz')):
+        return import_matrix(fname)
+    if fname.rsplit('.', 1)[-1] in CSV_CODECS:
+        import pandas as pd
+        return pd.read_csv(fname, sep=',', header=None, compression='infer', float_precision='round_trip').values
     else:
         return np.loadtxt(fname, delimiter=',')
 
 
+def export_matrix(V, fname, workers=2):
+    """Writes V to fname in the format of its extension: .npy (binary, exact) or .csv, .csv.bz2 (text)
+
+    workers threads compress csv files (see csv_export_matrix).
+    """
+    if fname.endswith('.npy'):
+        np.save(fname, V)
+    else:
+        csv_export_matrix(V, fname, workers=workers)
+
+
+def export_matrices(matrices, fname, compress=False):
+    """Writes dict of name -> matrix to the .npz archive fname (zlib compressed if compress)"""
+    if compress:
+        np.savez_compressed(fname, **matrices)
+    else:
+        np.savez(fname, **matrices)
+
+
+def import_matrix(fname, mmap_mode=None, name=None):
+    """Reads a matrix of export_matrix() or export_matrices() (the matrix name or the first of the archive)
+
+    .npy files are memory-mapped with mmap_mode (see numpy.load), e.g. 'r' to read large fields on demand.
+    """
+    if fname.endswith('.npy'):
+        return np.load(fname, mmap_mode=mmap_mode)
+    if fname.endswith('.npz'):
+        with np.load(fname) as f:
+            return f[f.files[0] if name is None else name]
+    return csv_import_matrix(fname)
+
+
 # validate solution1 with solution2
 def validate_solution_files(file_new, file_truth):
     fnew = open(file_new, 'r')
@@ -140,49 +267,31 @@ def get_system_info():
     return sysinfo
 
 
-def get_miscibility_gap(R, T, B, A0, A1, xlower=0.7, xupper=0.9999, prec=7):
-    x1 = sym.Symbol('x1', real=True)
-    x2 = sym.Symbol('x2', real=True)
-    c = x1
-    E = (R * T * (c * (sym.log(c) - B) + (1 - c) * sym.log(1 - c)) + (A0 + A1 * (1 - 2 * c)) * c * (1 - c))
-    y1 = E.copy()
-    c = x2
-    E = (R * T * (c * (sym.log(c) - B) + (1 - c) * sym.log(1 - c)) + (A0 + A1 * (1 - 2 * c)) * c * (1 - c))
-    y2 = E.copy()
-    # derivative of E at x1 and x2
-    dy1 = sym.diff(y1, x1, 1)
-    dy2 = sym.diff(y2, x2, 1)
-    # f'(x1) == f'(x2), x1!=x2
-    # f'(x1) == (y2-y1)/(x2-x1)
-    # ... https://mathematica.stackexchange.com/questions/25892/common-tangent-to-a-curve
-    eq1 = sym.Eq(dy1, dy2)  # dy1 == dy2
-    eq2 = sym.Eq(dy1, (y2 - y1) / (x2 - x1))
-    return sym.nsolve((eq1, eq2), (x1, x2), (xlower, xupper), prec=prec)
+@functools.lru_cache(maxsize=1024)
+def get_miscibility_gap(R, T, B, A0, A1, xlower=0.7, xupper=0.9999):
+    """Returns (c_A, c_B), the points of the common tangent of the Gibbs energy (see thermo.common_tangent)"""
+    ca, cb = thermo.common_tangent(R, T, B, A0, A1, xlower=xlower, xupper=xupper)
+    if np.isnan(ca):
+        raise ValueError(f"No common tangent found from starting point ({xlower}, {xupper}).")
+    return float(ca), float(cb)
 
 
+@functools.lru_cache(maxsize=1024)
 def get_distance_common_tangent(R, T, B, A0, A1, at):
-    x = sym.Symbol('x', real=True)
-    c = x
-    E = (R * T * (c * (sym.log(c) - B) + (1 - c) * sym.log(1 - c)) + (A0 + A1 * (1 - 2 * c)) * c * (1 - c))
-    ca, cb = get_miscibility_gap(R=R, T=T, B=B, A0=A0, A1=A1)
-    m = (E.subs(x, cb) - E.subs(x, ca)) / (cb - ca)
     # distance E and tangent at 0.875 for kappa~ base
-    dist = (E - m * (x - ca) - E.subs(x, ca)).subs(x, at)
-    return np.float64(dist)
+    gap = get_miscibility_gap(R=R, T=T, B=B, A0=A0, A1=A1)  # raises if there is no common tangent
+    return np.float64(thermo.distance_common_tangent(R, T, B, A0, A1, at, gap=gap))
 
 
+@functools.lru_cache(maxsize=1024)
 def get_roots_of_EPP(R, T, A0, A1):
-    x = sym.Symbol('x', real=True, positive=True)
-    c = x
-    EPP = (-2*A0*c**2+2*A0*c+12*A1*c**3 - 18*A1*c**2+6*A1*c-R*T)/(c**2-c)
-    #return sym.nsolve(EPP, (xlower, xupper), prec=prec, solver='bisect')
-    roots = sym.solveset(EPP, x, domain=sym.Interval(0, 1))
-    return list(roots)
+    """Returns list of the roots of G'' (spinodal) in (0, 1) (see thermo.spinodal)"""
+    return [float(root) for root in thermo.spinodal(R, T, A0, A1) if not np.isnan(root)]
 
 
 # https://stackoverflow.com/a/39662359
 def is_notebook() -> bool:
-    if module_exists('IPython'):
+    if 'IPython' in sys.modules:  # a notebook kernel has imported IPython already
         from IPython import get_ipython
     else:
         return False
@@ -233,6 +342,20 @@ def get_mem_usage():
     return f"{process.memory_info().rss / 1048576:.2f}MiB"
 
 
+def get_mem_available():
+    """Returns the memory in bytes which is available for new processes"""
+    return psutil.virtual_memory().available
+
+
+def estimate_run_memory(N, members=1, precision='float64'):
+    """Returns the estimated peak memory in bytes of a process running members N x N simulations
+
+    A run holds about 13 N x N arrays (work arrays, DCT buffers, integrator), 16 leave room for exports.
+    The remainder is the interpreter with numpy and scipy loaded (~100 MiB).
+    """
+    return 100 * 2**20 + 16 * N * N * np.dtype(precision).itemsize * members
+
+
 def get_mem_usage_all():
     if module_exists('resource'):
         import resource
@@ -244,6 +367,7 @@ def get_mem_usage_all():
 
 def pause_without_show(interval):
     # https://stackoverflow.com/questions/45729092/make-interactive-matplotlib-window-not-pop-to-front-on-each-update-windows-7/45734500#45734500
+    from matplotlib import pyplot as plt
     manager = plt._pylab_helpers.Gcf.get_active()
     if manager is not None:
         canvas = manager.canvas
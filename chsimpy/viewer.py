@@ -0,0 +1,338 @@
+"""
+Live plotting in a separate process: the solver publishes snapshots through shared memory and keeps integrating,
+and parallel offline rendering of spooled --png-anim frames
+
+"""
+
+import multiprocessing as mp
+import os
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import utils
+from .timedata import TimeData
+
+
+# parameters used by update_view(), passed to the rendering process (Parameters cannot be pickled)
+SETTINGS = ('N', 'XXX', 'M_tilde', 'delt', 'threshold', 'no_diagrams', 'adaptive_time')
+
+
+def update_view(view, params, solution, metrics):
+    """Sets U and the time data of solution (or a Snapshot) to the artists of a PlotView or MapView"""
+    if solution.domtime is None:
+        time_total = (1 / (params.M_tilde) * (solution.computed_steps-1) * params.delt)
+    else:
+        time_total = solution.domtime[-1] ** 3
+    view.set_Umap(U=solution.U,
+                  threshold=params.threshold,
+                  title=f"U <> {params.threshold}, total time = {utils.sec_to_min_if(time_total)}, "
+                        f"steps = {solution.computed_steps}")
+    if params.no_diagrams:
+        return  # RETURN as mapview only uses U and only renders Umap
+    #
+    #
+    view.set_Uline(U=solution.U, title='Slice at U(N/2,:)')
+    # metrics which are not computed (see --metrics) are not plotted
+    E = solution.E if 'E' in metrics else None
+    SA = solution.SA if 'SA' in metrics else None
+
+    if params.adaptive_time:
+        view.set_Eline_delt(E=E,
+                            it_range=solution.it_range,
+                            delt=solution.delt,
+                            title='Total Energy',
+                            computed_steps=solution.computed_steps)
+    else:
+        view.set_Eline(E=E,
+                       it_range=solution.it_range,
+                       title='Total Energy',
+                       computed_steps=solution.computed_steps)
+
+    view.set_SAlines(domtime=solution.domtime,
+                     SA=SA,
+                     title=f"Area of high silica (U <> {params.threshold})",
+                     computed_steps=solution.computed_steps,
+                     x2=time_total ** (1 / 3),  # = x2 of x axis
+                     t0=solution.t0)
+
+    view.set_E2line(E2=solution.E2,
+                    it_range=solution.it_range,
+                    title=f"Surf.Energy | Separation t0 = {utils.sec_to_min_if(solution.t0)}",
+                    computed_steps=solution.computed_steps,
+                    tau0=solution.tau0,
+                    t0=solution.t0)
+
+    view.set_Uhist(solution.U, "Solution Histogram")
+
+
+class Snapshot:
+    def __init__(self, N):
+        """Solution-like copy of the latest received frame in the rendering process"""
+        self.U = np.zeros((N, N))
+        self.timedata = TimeData()
+        self.computed_steps = 0
+        self.tau0 = 0
+        self.t0 = 0.0
+
+    def __getattr__(self, name: str):
+        if name in ('E','E2','SA','domtime','Ra','L2','PS','delt','accepted','rejected','it_range'):
+            return getattr(self.timedata, name)
+        raise AttributeError("No such attribute: " + name)
+
+
+class SnapshotChannel:
+    META = 4  # sequence number, computed_steps, tau0, t0
+
+    def __init__(self, N, context=mp):
+        """Single frame slot in shared memory (latest U and scalars) plus a queue of new time data rows
+
+        publish() never waits for the reader: if the slot is being read, the frame is dropped,
+        an unread frame is overwritten by the next one. Time data rows are never dropped.
+        """
+        self.N = N
+        self._shm = shared_memory.SharedMemory(create=True, size=(N * N + self.META) * 8)
+        self._owner = True
+        self._lock = context.Lock()
+        self._ready = context.Event()
+        self._stop = context.Event()
+        self._running = context.Event()  # set by the reader when it started reading
+        self._rows = context.Queue()
+        self.published = 0
+        self.dropped = 0
+        self._map()
+
+    def _map(self):
+        values = np.ndarray((self.N * self.N + self.META,), dtype=np.float64, buffer=self._shm.buf)
+        self._U = values[:self.N * self.N].reshape((self.N, self.N))
+        self._meta = values[self.N * self.N:]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_U']
+        del state['_meta']
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def publish(self, U, rows, computed_steps, tau0, t0):
+        """Offers a frame to the reader, returns False if it was dropped (reader is copying the slot)"""
+        if rows is not None and len(rows) > 0:
+            self._rows.put(np.array(rows))
+        if not self._lock.acquire(block=False):
+            self.dropped += 1
+            return False
+        try:
+            if self._ready.is_set():
+                self.dropped += 1  # previous frame was not read
+            np.copyto(self._U, U)
+            self._meta[:] = (self.published + 1, computed_steps, tau0, t0)
+        finally:
+            self._lock.release()
+        self.published += 1
+        self._ready.set()
+        return True
+
+    def receive(self, U, timeout=None):
+        """Copies the latest frame to U and returns (meta, list of new time data rows) or None after timeout"""
+        if not self._ready.wait(timeout):
+            return None
+        with self._lock:
+            np.copyto(U, self._U)
+            meta = self._meta.copy()
+            self._ready.clear()
+        rows = []
+        while True:
+            try:
+                rows.append(self._rows.get_nowait())
+            except queue.Empty:
+                break
+        return meta, rows
+
+    def stop(self):
+        self._stop.set()
+
+    def set_running(self):
+        self._running.set()
+
+    def running(self):
+        return self._running.is_set()
+
+    def stopped(self):
+        return self._stop.is_set()
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+            self._rows.cancel_join_thread()  # rows the reader did not take are dropped
+            self._rows.close()
+
+
+class AsyncViewer:
+    def __init__(self, params, metrics):
+        """Live plots of a PlotView or MapView (no_diagrams) rendered by a separate process
+
+        The solver publishes frames with publish() and continues without waiting for the rendering.
+        """
+        context = mp.get_context('spawn')  # fresh GUI state in the rendering process
+        self.channel = SnapshotChannel(params.N, context)
+        settings = {name: getattr(params, name) for name in SETTINGS}
+        self._rows_sent = 0
+        self._process = context.Process(target=_render, args=(self.channel, settings, metrics),
+                                        name='chsimpy-viewer', daemon=True)
+        self._process.start()
+
+    def publish(self, solution):
+        """Offers U and the new time data rows of solution to the renderer (False: frame dropped)"""
+        if not self._process.is_alive():  # e.g. window was closed
+            return False
+        rows = solution.timedata.data()[self._rows_sent:]
+        self._rows_sent += len(rows)
+        return self.channel.publish(solution.U, rows, solution.computed_steps, solution.tau0, solution.t0)
+
+    def close(self, timeout=5):
+        """Stops the rendering process (a process which is still starting up is terminated)"""
+        self.channel.stop()
+        if self.channel.running():
+            self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self.channel.close()
+
+
+def _render(channel, settings, metrics, min_interval=0.1):
+    """Main loop of the rendering process, renders the latest frame of channel until it is stopped
+    or the window is closed (the process exits, AsyncViewer.publish() then drops all frames)
+
+    Frames are rendered at most every min_interval seconds with lower priority, so the renderer
+    leaves the CPU to the solver if cores are scarce.
+    """
+    from types import SimpleNamespace
+    import matplotlib.pyplot as plt
+    from . import mapview
+    from . import plotview
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    params = SimpleNamespace(**settings)
+    if params.no_diagrams:
+        view = mapview.MapView(params.N)
+    else:
+        view = plotview.PlotView(params.N, params.XXX)
+    view.prepare(show=True)
+    view.imode_on()
+    view.show()
+    snapshot = Snapshot(params.N)
+    seq = 0
+    channel.set_running()
+    while not channel.stopped() and plt.fignum_exists(view.fig.number):
+        utils.pause_without_show(min_interval)  # keeps the window responsive
+        received = channel.receive(snapshot.U, timeout=0)
+        if received is None:
+            continue
+        meta, rows = received
+        for part in rows:
+            snapshot.timedata.extend(part)
+        if meta[0] == seq:
+            continue
+        seq = meta[0]
+        snapshot.computed_steps = int(meta[1])
+        snapshot.tau0 = _tau0(meta[2])
+        snapshot.t0 = meta[3]
+        update_view(view, params, snapshot, metrics)
+        view.draw()
+    channel.close()
+
+
+class FrameSpool:
+    META = 5  # part, computed_steps, tau0, t0, number of time data rows
+    PIXELS = 512  # larger U are downsampled to at most PIXELS per side (the map of a figure has fewer pixels)
+
+    def __init__(self, fname, N, dtype=np.float64):
+        """Appends frames (U in dtype and the scalars of a live plot update) to the binary file fname
+
+        The time data is written once by finish(), as a frame only uses the rows up to its step.
+        Frames are rendered later in parallel by render_frames().
+        """
+        self.fname = fname
+        self.N = N
+        self.stride = -(-N // self.PIXELS)
+        n = len(range(0, N, self.stride))
+        self.dtype = np.dtype([('meta', np.float64, (self.META,)), ('U', dtype, (n, n))])
+        self.frames = 0
+        self._record = np.zeros(1, dtype=self.dtype)
+        self._file = open(fname, 'wb')
+
+    def append(self, part, solution):
+        record = self._record[0]
+        record['meta'] = (part, solution.computed_steps, solution.tau0, solution.t0,
+                          solution.timedata.data().shape[0])
+        record['U'] = solution.U[::self.stride, ::self.stride]
+        self._record.tofile(self._file)
+        self.frames += 1
+
+    def finish(self, timedata):
+        self._file.close()
+        np.save(self.fname + '.timedata.npy', timedata.data())
+
+    def remove(self):
+        for fname in (self.fname, self.fname + '.timedata.npy'):
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+
+def render_frames(spool, params, metrics, file_id, processes=-1):
+    """Renders the frames of a finished FrameSpool to PNG files '<file_id>.<part>.png' with a pool of processes"""
+    if spool.frames == 0:
+        return
+    if processes < 1:
+        processes = utils.get_number_physical_cores()
+    processes = min(processes, spool.frames)
+    settings = {name: getattr(params, name) for name in SETTINGS}
+    bounds = np.linspace(0, spool.frames, processes + 1).astype(int)
+    tasks = [(spool.fname, spool.dtype, spool.stride, settings, metrics, file_id, first, last)
+             for first, last in zip(bounds[:-1], bounds[1:])]
+    if processes == 1:
+        _render_spooled(*tasks[0], worker=False)
+        return
+    with mp.get_context('spawn').Pool(processes=processes) as pool:
+        pool.starmap(_render_spooled, tasks)
+
+
+def _render_spooled(fname, dtype, stride, settings, metrics, file_id, first, last, worker=True):
+    """Renders frames first, ..., last-1 of a spool file (in a pool worker or in this process)"""
+    from types import SimpleNamespace
+    import matplotlib
+    from . import mapview
+    from . import plotview
+    if worker:
+        matplotlib.use('Agg')  # after the view modules, they might select a GUI backend
+    params = SimpleNamespace(**settings)
+    frames = np.memmap(fname, dtype=dtype, mode='r')
+    timedata = np.load(fname + '.timedata.npy', mmap_mode='r')
+    if params.no_diagrams:
+        view = mapview.MapView(params.N)
+    else:
+        view = plotview.PlotView(params.N, params.XXX)
+    view.imode_off()
+    view.prepare(show=False)
+    snapshot = Snapshot(params.N)
+    for frame in frames[first:last]:
+        part, computed_steps, tau0, snapshot.t0, rows = frame['meta']
+        snapshot.computed_steps = int(computed_steps)
+        snapshot.tau0 = _tau0(tau0)
+        U = np.repeat(np.repeat(frame['U'], stride, axis=0), stride, axis=1)[:params.N, :params.N]
+        snapshot.U = U.astype(np.float64)
+        snapshot.timedata = TimeData.from_data(timedata[:int(rows)])
+        update_view(view, params, snapshot, metrics)
+        view.render_to(f"{file_id}.{int(part):05d}.png")
+
+
+def _tau0(value):
+    """tau0 of a solution is 0.0 until separation is detected, then the step count (as shown in plot titles)"""
+    return value if value == 0 else int(value)
@@ -18,6 +18,7 @@ except ImportError:
 
 
 from chsimpy import Simulator, Parameters, CLIParser, utils, mport
+from chsimpy.ensemble import EnsembleSolver
 
 
 class BenchmarkParams:
@@ -25,6 +26,8 @@ class BenchmarkParams:
         self.runs = 3
         self.warmups = 1
         self.warmup_ntmax = 100
+        self.reference_ntmax = 100
+        self.batch = 1
 
 
 # parsing command-line-interface arguments
@@ -43,12 +46,23 @@ class BenchmarkCLIParser:
         group.add_argument('-W', '--warmup-ntmax',
                            type=int,
                            help='Number of simulation steps of a single benchmark warmup')
+        group.add_argument('--reference-ntmax',
+                           default=100,
+                           type=int,
+                           help='Number of simulation steps of the float64 reference run (if --precision=float32)')
+        group.add_argument('-B', '--batch',
+                           default=1,
+                           type=int,
+                           help='Compares B sequential runs (A0 varied by 1%%) with one ensemble of B members, '
+                                'e.g. to choose --batch of experiments')
 
     def get_parameters(self):
         params = self.cliparser.get_parameters()
         bmark_params = BenchmarkParams()
         bmark_params.runs = self.cliparser.args.runs
         bmark_params.warmups = self.cliparser.args.warmups
+        bmark_params.reference_ntmax = self.cliparser.args.reference_ntmax
+        bmark_params.batch = self.cliparser.args.batch
         params.no_gui = True
         if self.cliparser.args.warmup_ntmax is not None:
             bmark_params.warmup_ntmax = self.cliparser.args.warmup_ntmax
@@ -60,6 +74,10 @@ class BenchmarkCLIParser:
 
         if bmark_params.runs < 1:
             self.cliparser.parser.error('ERROR: --runs must be at least 1.')
+        if bmark_params.batch < 1:
+            self.cliparser.parser.error('ERROR: --batch must be at least 1.')
+        if bmark_params.batch > 1 and (params.adaptive_time or params.jitter is not None or params.warm_start > 1):
+            self.cliparser.parser.error('ERROR: --batch does not support --adaptive-time, --jitter or --warm-start.')
         if params.png or params.png_anim:
             self.cliparser.parser.error('Visualization must be disabled when running benchmarks.')
         return bmark_params, params
@@ -76,6 +94,46 @@ def time_repetitions(simulator, ntmax, repetitions):
     return tv_run
 
 
+def precision_deviation(params, U_init, ntmax):
+    """Runs ntmax steps with params.precision and float64, returns max. deviations of U, E and E2"""
+    solutions = []
+    for precision in (params.precision, 'float64'):
+        p = params.deepcopy()
+        p.precision = precision
+        p.ntmax = ntmax
+        p.time_max = None
+        p.full_sim = True
+        p.update_every = None
+        p.export_csv = None
+        solutions.append(Simulator(p, U_init).solve())
+    test, ref = solutions
+    dev_U = np.max(np.abs(test.U - ref.U))
+    dev_E = np.max(np.abs(test.E - ref.E) / np.abs(ref.E))
+    dev_E2 = np.max(np.abs(test.E2 - ref.E2) / np.abs(ref.E2))
+    return dev_U, dev_E, dev_E2
+
+
+def time_ensemble(params, U_init, members):
+    """Runs ntmax steps of members runs (A0 varied by 1%) one after another and as one ensemble,
+    returns both wall times in seconds"""
+    simulators = []
+    for i in range(members):
+        p = params.deepcopy()
+        p.full_sim = True  # same number of steps for all members
+        p.update_every = None
+        p.export_csv = None
+        p.func_A0 = lambda temp, fac=1.0 - 0.01 * i, func_A0=params.func_A0: func_A0(temp) * fac
+        simulators.append(Simulator(p, U_init))
+    t1 = time.time()
+    for simulator in simulators:
+        simulator.solve()
+    time_sequential = time.time() - t1
+    t1 = time.time()
+    EnsembleSolver([Simulator(s.params, U_init).solver for s in simulators]).solve()
+    time_ensemble = time.time() - t1
+    return time_sequential, time_ensemble
+
+
 if __name__ == '__main__':
 
     bmark_cliparser = BenchmarkCLIParser()
@@ -109,6 +167,16 @@ if __name__ == '__main__':
 
     time_total = time.time()-t1
     print(f"Benchmark Total: {time_total} sec")
+    deviation = None
+    if params.precision != 'float64':
+        deviation = precision_deviation(params, simulator.solver.U_init, bmark_params.reference_ntmax)
+        print(f"Deviation from float64 reference ({bmark_params.reference_ntmax} steps):")
+        print(f" max|U-U_ref| = {deviation[0]:g}, max rel. E = {deviation[1]:g}, max rel. E2 = {deviation[2]:g}")
+    ts_batch = None
+    if bmark_params.batch > 1:
+        ts_batch = time_ensemble(params, simulator.solver.U_init, bmark_params.batch)
+        print(f"Ensemble ({bmark_params.batch} members, ntmax={params.ntmax}):")
+        print(f" sequential: {ts_batch[0]} sec, ensemble: {ts_batch[1]} sec, speedup: {ts_batch[0] / ts_batch[1]:.2f}")
     file_id = simulator.solution_file_id
     with open(f"{file_id}.csv", 'w') as f:
         f.write("\n".join(sysinfo_list + bmark_params_list))
@@ -116,6 +184,10 @@ if __name__ == '__main__':
         f.write(f"warmup,{ts_warmup}\n")
         f.write(f"runs,{ts_runs}\n")
         f.write(f"total,{time_total}\n")
+        if deviation is not None:
+            f.write(f"deviation_U_E_E2,{deviation}\n")
+        if ts_batch is not None:
+            f.write(f"sequential_ensemble,{ts_batch}\n")
     print('Output files:')
     print(f"  results and meta data: {file_id}.csv")
     simulator.export()
@@ -27,6 +27,7 @@ setuptools.setup(
     install_requires=requirements,
     extras_require={
         'qt5': ['PyQt5'],
+        'fftw': ['pyFFTW'],
         'interactive': [
             'ipython~=8.0.0',
             'bokeh~=2.4.3',
@@ -13,7 +13,21 @@ except ImportError:
     import chsimpy
     # sys.path.remove(str(_parentdir))
 
-from chsimpy import Parameters, Solution, utils, mport
+from chsimpy import Parameters, Simulator, Solution, utils, mport
+from chsimpy import integrators, solver, transforms
+from chsimpy.ensemble import EnsembleSolver
+
+
+def create_params(N=32, fac_A0=None, **kwargs):
+    """Returns Parameters of a small run without GUI, other attributes are set by kwargs (A0 scaled by fac_A0)"""
+    params = Parameters()
+    params.N = N
+    params.no_gui = True
+    if fac_A0 is not None:
+        params.func_A0 = lambda temp: utils.A0(temp) * fac_A0
+    for name, value in kwargs.items():
+        setattr(params, name, value)
+    return params
 
 
 class TestLCG(unittest.TestCase):
@@ -36,6 +50,16 @@ class TestLCG(unittest.TestCase):
         lcg_matrix = chsimpy.mport.matlab_lcg_sample(5, 4, 2023)
         self.assertTrue(np.allclose(lcg_matrix, lcg_matrix_raw))
 
+    def test_lcg_cycle(self):
+        """
+        Test if the repeated cycle of the LCG gives exactly the values of the sequential generator
+        """
+        n1, n2, seed = 150, 120, 2023  # cycle starts after 14247 values
+        gen = chsimpy.mport._lcg(seed, np.float64(1103515245), np.float64(12345), np.float64(2 ** 31))
+        values = np.array([next(gen) for _ in range(n1 * n2)]) / (2 ** 31 - 1)
+        lcg_matrix = chsimpy.mport.matlab_lcg_sample(n1, n2, seed)
+        self.assertTrue(np.array_equal(lcg_matrix, values.reshape((n2, n1)).T))
+
 
 class TestDumpParameters(unittest.TestCase):
 
@@ -118,6 +142,624 @@ class TestDumpSolution(unittest.TestCase):
         if os.path.isfile(fname):
             os.remove(fname)
 
+    def test_csv_compress_streams(self):
+        """
+        Test if blockwise compressed csv files (several streams) are exact and readable by the standard readers
+        """
+        import bz2
+        import gzip
+        import tempfile
+        rng = np.random.default_rng(2023)
+        matrix = rng.random((70, 33))
+        matrix[5, 7] = np.nan
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for codec, opener in (('bz2', bz2.open), ('gz', gzip.open)):
+                fname = os.path.join(tmpdir, f"test-matrix.csv.{codec}")
+                chsimpy.utils.csv_export_matrix(matrix, fname, workers=2, block_rows=16)  # 5 streams
+                self.assertTrue(np.array_equal(chsimpy.utils.csv_import_matrix(fname), matrix, equal_nan=True))
+                with opener(fname, 'rt') as f:
+                    self.assertTrue(np.array_equal(np.loadtxt(f, delimiter=','), matrix, equal_nan=True))
+
+    def test_binary_export_roundtrip(self):
+        """
+        Test if npy and npz exports read back exactly and an exported U can be used as --Uinit-file
+        """
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            solutions = {}
+            for export_format in ('npy', 'npz', 'csv'):
+                params = Parameters()
+                params.N = 32
+                params.ntmax = 20
+                params.no_gui = True
+                params.export_csv = 'U,E2'
+                params.export_format = export_format
+                params.file_id = os.path.join(tmpdir, export_format)
+                simulator = Simulator(params)
+                solutions[export_format] = simulator.solve()
+                simulator.export()
+            for export_format in ('npy', 'csv'):
+                for member in ('U', 'E2'):
+                    fname = os.path.join(tmpdir, f"{export_format}.solution.{member}.{export_format}")
+                    self.assertTrue(np.array_equal(chsimpy.utils.import_matrix(fname),
+                                                   getattr(solutions[export_format], member)))
+            fname = os.path.join(tmpdir, 'npz.solution.npz')
+            self.assertTrue(np.array_equal(chsimpy.utils.import_matrix(fname, name='E2'), solutions['npz'].E2))
+            self.assertTrue(np.array_equal(chsimpy.utils.csv_import_matrix(fname), solutions['npz'].U))
+            fname = os.path.join(tmpdir, 'npy.solution.U.npy')
+            runs = []
+            for U_init in (None, np.load(fname)):
+                params = Parameters()
+                params.N = 32
+                params.ntmax = 10
+                params.no_gui = True
+                params.Uinit_file = fname
+                simulator = Simulator(params, U_init)
+                runs.append(simulator.solve().U)
+                if U_init is None:
+                    self.assertIsInstance(simulator.solver.U_init, np.memmap)
+            self.assertTrue(np.array_equal(runs[0], runs[1]))
+
+
+class TestSolver(unittest.TestCase):
+
+    def test_inplace_gradient(self):
+        """
+        Test if in-place gradient of the solver matches np.gradient
+        """
+        rng = np.random.default_rng(2023)
+        U = rng.random((17, 17))
+        out = np.empty_like(U)
+        for axis in (0, 1):
+            expected = np.gradient(U, 0.25, axis=axis, edge_order=1)
+            self.assertTrue(np.array_equal(solver._gradient(U, 0.25, axis=axis, out=out), expected))
+
+    def test_resume_reuses_work_buffers(self):
+        """
+        Test if resuming keeps stepping in the preallocated work arrays
+        """
+        params = Parameters()
+        params.N = 32
+        params.ntmax = 20
+        params.no_gui = True
+        params.full_sim = True
+        simulator = Simulator(params)
+        solution = simulator.solve()
+        U = solution.U
+        self.assertIs(U, simulator.solver._work.U)
+        simulator.solver.solve_or_resume(10)
+        self.assertIs(solution.U, U)
+        self.assertEqual(solution.computed_steps, 30)
+        self.assertTrue(np.all(np.isfinite(U)))
+
+    def test_float32_precision(self):
+        """
+        Test if float32 simulation stays close to float64 and keeps float64 diagnostics
+        """
+        params = Parameters()
+        params.N = 32
+        params.ntmax = 50
+        params.no_gui = True
+        params.full_sim = True
+        ref = Simulator(params).solve()
+        params.precision = 'float32'
+        sol = Simulator(params).solve()
+        self.assertEqual(sol.U.dtype, np.float32)
+        self.assertEqual(sol.Seig.dtype, np.float32)
+        self.assertEqual(sol.E2.dtype, np.float64)
+        self.assertTrue(np.allclose(sol.U, ref.U, atol=1e-5))
+        self.assertTrue(np.allclose(sol.E2, ref.E2, rtol=1e-4))
+
+    def test_diagnostics_cadence(self):
+        """
+        Test if metrics are only computed every diag_every steps and only the selected ones
+        """
+        params = Parameters()
+        params.N = 32
+        params.ntmax = 51
+        params.no_gui = True
+        params.full_sim = True
+        params.diag_every = 5
+        params.metrics = 'E2,SA'
+        sol = Simulator(params).solve()
+        self.assertEqual(sol.computed_steps, 51)
+        self.assertTrue(np.array_equal(sol.it_range, np.arange(0, 51, 5)))
+        self.assertTrue(np.all(np.isnan(sol.E)) and np.all(np.isnan(sol.PS)))
+        self.assertFalse(np.any(np.isnan(sol.E2)) or np.any(np.isnan(sol.SA)))
+        with self.assertRaises(ValueError):
+            chsimpy.TimeData.parse_metrics('E2,XYZ')
+
+    def test_resume_keeps_spectral_state(self):
+        """
+        Test if resuming in chunks gives the same result as one run (hat_U is kept between resumes)
+        """
+        params = Parameters()
+        params.N = 32
+        params.no_gui = True
+        params.full_sim = True
+        params.spectral_energy = True
+        simulator = Simulator(params)
+        simulator.solver.prepare()
+        U_single = simulator.solver.solve_or_resume(100).U.copy()
+        simulator = Simulator(params)
+        simulator.solver.prepare()
+        for _ in range(4):
+            solution = simulator.solver.solve_or_resume(25)
+        self.assertTrue(np.array_equal(U_single, solution.U))
+        self.assertTrue(np.all(solution.E2 > 0))
+
+    def test_warm_start(self):
+        """
+        Test if a progressive-resolution run continues the coarse time data on the target grid
+        """
+        U = np.random.default_rng(1).random((8, 8))
+        self.assertTrue(np.allclose(solver.resample(solver.resample(U, 16), 8), U))
+        params = Parameters()
+        params.N = 64
+        params.ntmax = 3000
+        params.delt = 1e-6
+        params.no_gui = True
+        params.warm_start = 2
+        simulator = Simulator(params)
+        solution = simulator.solve()
+        self.assertEqual(solution.stop_reason, 'energy')
+        self.assertEqual(solution.U.shape, (64, 64))
+        self.assertTrue(np.array_equal(solution.timedata.it_range, np.arange(solution.computed_steps)))
+        self.assertTrue(np.all(np.diff(solution.domtime) > 0))
+        self.assertLess(np.argmin(solution.E2), solution.tau0)
+        self.assertTrue(np.isclose(np.mean(solution.U), np.mean(simulator.solver.U_init)))
+
+    def test_checkpoint_resume(self):
+        """
+        Test if resuming a checkpoint continues bit-for-bit (jitter stream and multistep history included)
+        """
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            settings = dict(ntmax=200, full_sim=True, integrator='bdf2', jitter=0.01,
+                            file_id=os.path.join(tmpdir, 'run'))
+            reference = Simulator(create_params(**settings)).solve()
+            # last checkpoint after 120 steps
+            Simulator(create_params(**dict(settings, ntmax=130, checkpoint_every=40))).solve()
+            params = create_params(**dict(settings, jitter=None, resume=os.path.join(tmpdir, 'run.checkpoint.npz')))
+            solution = Simulator(params).solve()
+            self.assertEqual(params.jitter, 0.01)  # from the checkpoint
+            self.assertEqual(solution.computed_steps, 200)
+            self.assertTrue(np.array_equal(solution.U, reference.U))
+            self.assertTrue(np.array_equal(solution.timedata.data(), reference.timedata.data(), equal_nan=True))
+
+    def test_spill_timedata(self):
+        """
+        Test if time data in a memory-mapped spill file grows like in RAM and can be loaded after the run
+        """
+        import tempfile
+        from chsimpy import TimeData
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # buffer grows once
+            settings = dict(N=16, ntmax=TimeData.CAPACITY + 100, full_sim=True, file_id=os.path.join(tmpdir, 'run'))
+            reference = Simulator(create_params(**settings)).solve()
+            solution = Simulator(create_params(**settings, spill_timedata=True)).solve()
+            data = solution.timedata.data()
+            self.assertEqual(data.shape, (TimeData.CAPACITY + 100, len(TimeData.COLUMNS)))
+            self.assertTrue(np.array_equal(data, reference.timedata.data(), equal_nan=True))
+            self.assertTrue(np.array_equal(solution.E2, reference.E2))
+            loaded = TimeData.load_spill(os.path.join(tmpdir, 'run.timedata.npy'))
+            self.assertTrue(np.array_equal(loaded.data(), data, equal_nan=True))
+
+    def test_wall_limit(self):
+        """
+        Test if runs (single and ensemble) stop at the wall-clock limit
+        """
+        import time
+        params = Parameters()
+        params.N = 32
+        params.ntmax = int(1e7)
+        params.full_sim = True
+        params.no_gui = True
+        params.wall_max = 0.5 / 60  # seconds
+        start = time.monotonic()
+        solution = Simulator(params).solve()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(solution.stop_reason, 'wall-limit')
+        self.assertEqual(len(solution.E2), solution.computed_steps)
+        solvers = [solver.Solver(params) for _ in range(2)]
+        EnsembleSolver(solvers).solve()
+        self.assertEqual([s.solution.stop_reason for s in solvers], ['wall-limit'] * 2)
+
+
+class TestUinit(unittest.TestCase):
+
+    def test_simplex_matches_opensimplex(self):
+        """
+        Test if the vectorized simplex noise gives exactly the values of opensimplex
+        """
+        import opensimplex
+        from chsimpy import uinit
+        x = np.linspace(-5, 48, 37)
+        y = np.linspace(0, 30, 23)
+        self.assertTrue(np.array_equal(uinit.simplex_noise2array(x, y), opensimplex.noise2array(x, y)))
+        # falls back to the public API if the internals of opensimplex are missing
+        from unittest import mock
+        with mock.patch.dict(sys.modules, {'opensimplex.internals': None}):
+            self.assertTrue(np.array_equal(uinit.simplex_noise2array(x, y), opensimplex.noise2array(x, y)))
+
+    def test_cache_keeps_generator_stream(self):
+        """
+        Test if cached initial fields equal generated ones and random streams continue as without cache
+        """
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for generator in ['uniform', 'sobol', 'lcg']:
+                params = Parameters()
+                params.N = 16
+                params.generator = generator
+                generated = solver.Solver(params)
+                params.Uinit_cache = tmpdir
+                first = solver.Solver(params)  # stores
+                cached = solver.Solver(params)  # loads
+                self.assertIsInstance(cached.U_init, np.memmap)
+                self.assertTrue(np.array_equal(generated.U_init, first.U_init))
+                self.assertTrue(np.array_equal(generated.U_init, cached.U_init))
+                if generator != 'lcg':
+                    self.assertTrue(np.array_equal(generated.create_rand(16), cached.create_rand(16)))
+            self.assertEqual(len(os.listdir(tmpdir)), 3)
+
+
+class TestNoiseProvider(unittest.TestCase):
+
+    def test_stream_order(self):
+        """
+        Test if background-produced jitter fields follow the sequential stream of the generator
+        """
+        from chsimpy import noise
+        rng1 = np.random.default_rng(2023)
+        rng2 = np.random.default_rng(2023)
+        provider = noise.NoiseProvider(lambda n: rng1.random((n, n)), 8, 0.01, depth=2)
+        for _ in range(5):
+            self.assertTrue(np.array_equal(provider.next(), 0.01 * (2 * rng2.random((8, 8)) - 1)))
+        provider.close()
+
+
+class TestViewer(unittest.TestCase):
+
+    def test_snapshot_channel_drops_frames(self):
+        """
+        Test if the publisher never waits: unread or locked frames are dropped, time data rows are kept
+        """
+        from chsimpy import viewer
+        channel = viewer.SnapshotChannel(4)
+        try:
+            U = np.arange(16.0).reshape((4, 4))
+            rows = np.arange(33.0).reshape((3, 11))
+            self.assertTrue(channel.publish(U, rows[:2], computed_steps=10, tau0=0, t0=0.0))
+            self.assertTrue(channel.publish(U + 1, rows[2:], computed_steps=20, tau0=0, t0=0.0))
+            with channel._lock:  # reader is copying the slot
+                self.assertFalse(channel.publish(U + 2, None, computed_steps=30, tau0=0, t0=0.0))
+            self.assertEqual(channel.dropped, 2)
+            out = np.empty((4, 4))
+            meta, received = channel.receive(out, timeout=1)
+            self.assertTrue(np.array_equal(out, U + 1))
+            self.assertEqual(meta[1], 20)
+            while sum(len(r) for r in received) < len(rows):  # rows arrive through a pipe
+                received.append(channel._rows.get(timeout=5))
+            self.assertTrue(np.array_equal(np.vstack(received), rows))
+            self.assertIsNone(channel.receive(out, timeout=0))
+        finally:
+            channel.close()
+
+    def test_renderer_exits_when_window_closed(self):
+        """
+        Test if the rendering process leaves its loop when the figure is closed (the channel is not stopped)
+        """
+        import subprocess
+        script = ("import matplotlib.pyplot as plt\n"
+                  "from chsimpy import Parameters, viewer\n"
+                  "params = Parameters()\n"
+                  "params.N = 16\n"
+                  "channel = viewer.SnapshotChannel(params.N)\n"
+                  "receive = channel.receive\n"
+                  "def receive_and_close(U, timeout=None):\n"
+                  "    plt.close('all')  # window closed by the user\n"
+                  "    return receive(U, timeout)\n"
+                  "channel.receive = receive_and_close\n"
+                  "viewer._render(channel, {name: getattr(params, name) for name in viewer.SETTINGS}, None)\n"
+                  "print(channel.stopped())\n")
+        env = dict(os.environ, MPLBACKEND='Agg',
+                   PYTHONPATH=str(pathlib.Path(chsimpy.__file__).resolve().parents[1]))
+        output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                timeout=60, check=True).stdout.splitlines()
+        self.assertEqual(output[-1], 'False')
+
+    def test_spooled_png_anim(self):
+        """
+        Test if --png-anim frames are rendered from the spool after the run and the spool is removed
+        """
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            params = Parameters()
+            params.N = 32
+            params.ntmax = 30
+            params.no_gui = True
+            params.full_sim = True
+            params.png_anim = True
+            params.update_every = 10
+            params.png_anim_processes = 1
+            params.file_id = os.path.join(tmpdir, 'anim')
+            Simulator(params).solve()
+            self.assertEqual(sorted(os.listdir(tmpdir)), [f"anim.{part:05d}.png" for part in range(3)])
+
+    def test_histogram_updates_bars(self):
+        """
+        Test if the solution histogram keeps its bars and shows bin probabilities of U
+        """
+        import matplotlib
+        matplotlib.use('Agg')
+        from chsimpy import plotview
+        view = plotview.PlotView(32, 0.875)
+        view.imode_off()
+        view.prepare(show=False)
+        U = np.random.default_rng(2023).uniform(0.8, 0.9, (32, 32))
+        view.set_Uhist(U, "Solution Histogram")
+        bars = view.Uhist
+        view.set_Uhist(U ** 2, "Solution Histogram")
+        self.assertIs(view.Uhist, bars)
+        counts, edges = np.histogram(U ** 2, bins=view.bins)
+        self.assertTrue(np.allclose([bar.get_height() for bar in bars], counts / U.size))
+        self.assertTrue(np.allclose([bar.get_x() for bar in bars], edges[:-1]))
+
+    def test_headless_png(self):
+        """
+        Test if --png of --no-gui --no-diagrams runs is written by the lookup table renderer without a figure
+        """
+        import tempfile
+        import matplotlib.image
+        from chsimpy import pngmap
+        with tempfile.TemporaryDirectory() as tmpdir:
+            params = Parameters()
+            params.N = 32
+            params.ntmax = 10
+            params.no_gui = True
+            params.no_diagrams = True
+            params.png = True
+            params.file_id = os.path.join(tmpdir, 'map')
+            simulator = Simulator(params)
+            self.assertIsNone(simulator.view)
+            solution = simulator.solve()
+            simulator.render()
+            image = matplotlib.image.imread(params.file_id + '.png')
+        self.assertEqual(image.shape[:2], (32, 32))
+        renderer = pngmap.MapRenderer(32, mode='linear')
+        expected = renderer.lut[renderer.indices(solution.U)]
+        self.assertTrue(np.array_equal(np.round(image[..., :3] * 255).astype(np.uint8), expected))
+
+
+class TestImports(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        """
+        Test if a --no-gui run (and import chsimpy) does not import heavy dependencies which it does not use
+        """
+        import subprocess
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            script = ("import sys, time\n"
+                      "t = time.perf_counter()\n"
+                      "import chsimpy\n"
+                      "print(time.perf_counter() - t)\n"
+                      "from chsimpy import Parameters, Simulator\n"
+                      "params = Parameters()\n"
+                      "params.N = 32\n"
+                      "params.ntmax = 10\n"
+                      "params.no_gui = True\n"
+                      "params.no_diagrams = True\n"
+                      "params.png = True\n"
+                      f"params.file_id = {os.path.join(tmpdir, 'run')!r}\n"
+                      "simulator = Simulator(params)\n"
+                      "simulator.solve()\n"
+                      "simulator.render()\n"
+                      "print(','.join(m for m in ('matplotlib', 'sympy', 'pandas', 'scipy.stats', 'opensimplex',\n"
+                      "                          'IPython', 'PyQt5') if m in sys.modules))\n")
+            env = dict(os.environ, PYTHONPATH=str(pathlib.Path(chsimpy.__file__).resolve().parents[1]))
+            output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                    check=True).stdout.splitlines()
+        print()
+        print(f"import chsimpy: {float(output[0]) * 1000:.1f} ms ({self.__str__()})")
+        self.assertLess(float(output[0]), 0.5)  # no submodules are imported
+        self.assertEqual(output[1], '')
+
+    def test_submodule_access(self):
+        """
+        Test if submodules are reachable after a bare import chsimpy (e.g. chsimpy.utils in notebooks)
+        """
+        import subprocess
+        script = ("import chsimpy\n"
+                  "print(chsimpy.utils.csv_import_matrix.__name__, chsimpy.mport.__name__)\n"
+                  "print(hasattr(chsimpy, 'no_such_module'))\n")
+        env = dict(os.environ, PYTHONPATH=str(pathlib.Path(chsimpy.__file__).resolve().parents[1]))
+        output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                check=True).stdout.splitlines()
+        self.assertEqual(output, ['csv_import_matrix chsimpy.mport', 'False'])
+
+
+class TestExperiment(unittest.TestCase):
+
+    def test_journal_resume(self):
+        """
+        Test if journaled results are read back exactly and an interrupted last line is cut off
+        """
+        import tempfile
+        from chsimpy import experiment
+        results = [(-151.1, -85.6, 0.81, 0.97, 0.85, 0.95, np.int64(3), 0.1 / 3, 49, run_id, 1 / 3, None, 0.5,
+                    'energy') for run_id in range(3)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'exp' + experiment.JOURNAL_SUFFIX)
+            journal = experiment.Journal(fname)
+            journal.create({'experiment': {'runs': 3}})
+            journal.append(results[:2])
+            journal.close()
+            with open(fname, 'a') as f:
+                f.write('{"A0": -15')  # interrupted write
+            journal = experiment.Journal(fname)
+            header, results_read = journal.read()
+            journal.append(results[2:])
+            journal.close()
+            self.assertEqual(header, {'experiment': {'runs': 3}})
+            self.assertEqual(results_read, results[:2])
+            journal = experiment.Journal(fname)
+            self.assertEqual(journal.read()[1], results)
+            journal.close()
+
+
+class TestCoefficientCache(unittest.TestCase):
+
+    def test_shared_readonly_coefficients(self):
+        """
+        Test if equal parameters share one read-only coefficient set and the cache stays within its bound
+        """
+        N = 16
+        leig = np.add.outer(2 * np.cos(np.pi * np.arange(N) / (N - 1)) - 2, np.zeros(N))
+        self.assertTrue(np.array_equal(utils.eigenvalues(N), leig + leig.T))
+        params = Parameters()
+        params.N = N
+        params.kappa_tilde = 0.01
+        s1, s2 = Solution(params), Solution(params)
+        self.assertIs(s1.CHeig, s2.CHeig)
+        self.assertFalse(s1.Seig.flags.writeable)
+        CHeig, Seig = utils.get_coefficients(N=N, kappa_tilde=0.01, delt=params.delt, delx2=s1.delx2, cache=False)
+        self.assertTrue(np.array_equal(CHeig, s1.CHeig) and np.array_equal(Seig, s1.Seig))
+        cache = utils.ArrayCache(max_bytes=3 * N * N * 8)
+        for i in range(5):
+            cache.get(i, lambda: np.ones((N, N)))
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        self.assertEqual(cache.misses, 5)
+        cache.get(4, lambda: None)
+        self.assertEqual(cache.hits, 1)
+
+
+class TestEnsembleSolver(unittest.TestCase):
+
+    def test_ensemble_matches_single_runs(self):
+        """
+        Test if members of an ensemble give the same solutions as single runs (incl. early stop)
+        """
+        settings = dict(ntmax=5000, delt=1e-7)
+        facs = [1.0, 0.99]
+        singles = [Simulator(create_params(fac_A0=fac, **settings)).solve() for fac in facs]
+        simulators = [Simulator(create_params(fac_A0=fac, **settings)) for fac in facs]
+        members = EnsembleSolver([s.solver for s in simulators]).solve()
+        for single, member in zip(singles, members):
+            self.assertEqual(single.stop_reason, member.stop_reason)
+            self.assertEqual(single.tau0, member.tau0)
+            self.assertEqual(single.computed_steps, member.computed_steps)
+            self.assertTrue(np.allclose(single.U, member.U))
+            self.assertTrue(np.allclose(single.E2, member.E2))
+
+
+class TestThermo(unittest.TestCase):
+
+    def test_matches_sympy(self):
+        """
+        Test if the numeric miscibility gap and spinodal agree with sympy and the vectorized versions with the scalars
+        """
+        from chsimpy import thermo
+        R, B = 0.0083144626181532, 12.86
+        temps = np.array([873.15, 923.15, 973.15])
+        A0, A1 = utils.A0(temps) * 1.003, utils.A1(temps) * 0.996
+        gaps = np.array(thermo.common_tangent(R, temps, B, A0, A1))
+        roots = np.array(thermo.spinodal(R, temps, A0, A1))
+        for i, T in enumerate(temps):
+            reference = thermo.sympy_common_tangent(R, T, B, A0[i], A1[i], prec=20)
+            self.assertTrue(np.allclose(gaps[:, i], [float(reference[0]), float(reference[1])], rtol=0, atol=1e-10))
+            self.assertTrue(np.allclose(utils.get_miscibility_gap(R, T, B, A0[i], A1[i]), gaps[:, i], rtol=0, atol=1e-14))
+            reference = [float(root) for root in thermo.sympy_spinodal(R, T, A0[i], A1[i])]
+            self.assertTrue(np.allclose(roots[:, i], reference, rtol=0, atol=1e-10))
+            self.assertTrue(np.allclose(utils.get_roots_of_EPP(R, T, A0[i], A1[i]), roots[:, i], rtol=0, atol=1e-14))
+        self.assertTrue(np.all(np.isnan(thermo.spinodal(R, 2000.0, A0[0], A1[0]))))  # above the critical temperature
+
+
+class TestTransforms(unittest.TestCase):
+
+    def test_backends_match_orthonormal_dct(self):
+        """
+        Test if all available DCT backends transform in place like scipy.fft.dctn(norm='ortho')
+        """
+        import scipy.fft
+        rng = np.random.default_rng(2023)
+        x = rng.random((24, 24))
+        backends = [b for b in transforms.BACKENDS if b != 'pyfftw' or utils.module_exists('pyfftw')]
+        for backend in backends:
+            dct = transforms.create(backend, workers=2)
+            y = dct.empty(x.shape)
+            y[:] = x
+            self.assertIs(dct.forward(y), y)
+            self.assertTrue(np.allclose(y, scipy.fft.dctn(x, norm='ortho')), backend)
+            self.assertIs(dct.inverse(y), y)
+            self.assertTrue(np.allclose(y, x), backend)
+
+
+class TestIntegrators(unittest.TestCase):
+
+    def test_stabilized_integrators_allow_larger_steps(self):
+        """
+        Test if stabilized integrators stay bounded at delt=2e-6 and second-order schemes stop within 10% of the
+        t0 of a fine-delt semi-implicit run (tolerance of the documented delt range, see integrators.py)
+        """
+        reference = Simulator(create_params(integrator='semi-implicit', delt=1e-7, ntmax=20000)).solve()
+        for name in integrators.INTEGRATORS[1:]:
+            solution = Simulator(create_params(integrator=name, delt=2e-6, ntmax=3000)).solve()
+            self.assertEqual(solution.stop_reason, 'energy', name)
+            self.assertTrue(np.all((solution.U > 0) & (solution.U < 1)), name)
+            self.assertLess(solution.tau0, reference.tau0 / 10, name)
+            if name in ('bdf2', 'etdrk2'):
+                self.assertLess(abs(solution.t0 - reference.t0) / reference.t0, 0.1, name)
+
+    def test_ensemble_matches_single_runs(self):
+        """
+        Test if ensemble members with different stabilization match single runs of a multistep integrator
+        """
+        facs = [1.0, 0.99]
+        settings = dict(integrator='bdf2', delt=1e-6, ntmax=3000)
+        singles = [Simulator(create_params(fac_A0=fac, **settings)).solve() for fac in facs]
+        simulators = [Simulator(create_params(fac_A0=fac, **settings)) for fac in facs]
+        self.assertNotEqual(simulators[0].solver.integrator.S, simulators[1].solver.integrator.S)
+        members = EnsembleSolver([s.solver for s in simulators]).solve()
+        for single, member in zip(singles, members):
+            self.assertEqual(single.tau0, member.tau0)
+            self.assertTrue(np.allclose(single.U, member.U))
+
+    def test_adaptive_time_stepping(self):
+        """
+        Test if error-controlled adaptive stepping grows delt, reuses cached multipliers of the delt ladder,
+        logs its step counts and stops near the fixed-step t0
+        """
+        reference = Simulator(create_params(integrator='semi-implicit', delt=1e-6, ntmax=3000)).solve()
+        params = create_params(integrator='semi-implicit', delt=1e-7, ntmax=3000)
+        params.adaptive_time = True
+        hits = utils.coefficient_cache.hits
+        solution = Simulator(params).solve()
+        self.assertEqual(solution.stop_reason, 'energy')
+        self.assertLess(solution.tau0, reference.tau0)
+        self.assertGreaterEqual(utils.coefficient_cache.hits - hits, 2 * solution.computed_steps)
+        self.assertGreater(np.max(solution.delt), 10 * params.delt)
+        self.assertLessEqual(np.max(solution.delt), params.delt_max)
+        self.assertEqual(solution.accepted[-1], solution.computed_steps - 1)
+        self.assertTrue(np.all(np.diff(solution.E) <= 1e-10 * np.abs(solution.E[:-1])))
+        self.assertLess(abs(solution.t0 - reference.t0) / reference.t0, 0.25)
+        self.assertTrue(np.all(np.isnan(reference.accepted)))
+
+    def test_adaptive_stops_if_not_finite(self):
+        """
+        Test if an adaptive run stops with the last finite field when a step diverges even at delt_min
+        """
+        params = create_params(integrator='semi-implicit', delt=1e-3, ntmax=3000)
+        params.adaptive_time = True
+        params.full_sim = True
+        params.delt_min = params.delt_max = 1e-3
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            solution = Simulator(params).solve()
+        self.assertEqual(solution.stop_reason, 'non-finite')
+        self.assertTrue(np.all(np.isfinite(solution.U)))
+        self.assertTrue(np.all(np.isfinite(solution.E)))
+
 
 if __name__ == '__main__':
     unittest.main()